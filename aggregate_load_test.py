@@ -0,0 +1,106 @@
+import argparse
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from aggregate_service import DEFAULT_ADDRESS, AggregateClient, connection_pool, parse_address
+from insurance_aggregates import normalize_filters
+from insurance_query import parse_query
+
+# Questions a simulated session asks now and then (as typed into the xl2 dashboard's text box)
+QUESTIONS = ['total gwp year wise in pie chart', 'average loss ratio by insured type in bar chart',
+             'count of claims by year', 'maximum profit by insured type']
+
+
+# Function to pick a random filter combination, the way a user clicks through the sidebar
+def random_filters(rng, summary):
+    years = rng.sample(summary['years'], rng.randint(1, len(summary['years'])))
+    insured_types = rng.sample(summary['insured_types'], rng.randint(1, len(summary['insured_types'])))
+    low, high = summary['loss_ratio_range']
+    # Slider positions snap to a coarse grid, so sessions repeat each other's filters like real users do
+    steps = sorted(rng.sample(range(11), 2))
+    loss_ratio_range = (low + (high - low) * steps[0] / 10, low + (high - low) * steps[1] / 10)
+    return normalize_filters(years, insured_types, loss_ratio_range)
+
+
+# Function to simulate one dashboard session: a rerun refreshes, then requests the aggregates (and sometimes a query).
+# Like the sessions of one Streamlit process, every session shares the process's connection pool
+def run_session(session, address, dataset, reruns, think_time, latencies, errors):
+    rng = random.Random(session)
+    client = AggregateClient(dataset, address)
+    for _ in range(reruns):
+        start = time.perf_counter()
+        try:
+            client.refresh()
+            summary = client.describe()
+            filters = random_filters(rng, summary)
+            client.aggregates(filters)
+            if rng.random() < 0.25:
+                intent = parse_query(rng.choice(QUESTIONS), summary['insured_types'])
+                if intent is not None:
+                    client.query(filters, intent)
+        except (RuntimeError, ConnectionError):
+            errors.append(session)
+        latencies.append(time.perf_counter() - start)
+        time.sleep(rng.uniform(0, 2 * think_time))
+
+
+# Function to wait until the service accepts connections
+def wait_for_service(address, dataset, timeout=60):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            AggregateClient(dataset, address).refresh()
+            return
+        except (ConnectionError, OSError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate concurrent dashboard sessions against the aggregate service.")
+    parser.add_argument('--sessions', type=int, default=16, help="concurrent sessions")
+    parser.add_argument('--reruns', type=int, default=50, help="reruns per session")
+    parser.add_argument('--think-time', type=float, default=0.05, help="average seconds between a session's reruns")
+    parser.add_argument('--dataset', default='insurance_xl2', help="dataset name (see aggregate_service.DATASETS)")
+    parser.add_argument('--address', default=f"{DEFAULT_ADDRESS[0]}:{DEFAULT_ADDRESS[1]}", help="host:port of the service")
+    parser.add_argument('--start-service', action='store_true', help="start the service for the test and stop it after")
+    parser.add_argument('--workers', type=int, help="worker processes of a started service")
+    args = parser.parse_args()
+    address = parse_address(args.address)
+
+    service = None
+    if args.start_service:
+        command = [sys.executable, 'aggregate_service.py', '--address', args.address]
+        if args.workers:
+            command += ['--workers', str(args.workers)]
+        service = subprocess.Popen(command)
+    try:
+        wait_for_service(address, args.dataset)
+
+        latencies, errors = [], []
+        threads = [threading.Thread(target=run_session, args=(session, address, args.dataset, args.reruns, args.think_time, latencies, errors))
+                   for session in range(args.sessions)]
+        start_time = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start_time
+
+        # Rerun latency percentiles and throughput
+        latencies_ms = np.array(latencies) * 1000
+        print(f"{args.sessions} sessions, {len(latencies)} reruns in {elapsed:.2f} s ({len(latencies) / elapsed:.1f} reruns/s), {len(errors)} errors")
+        print(f"latency ms: p50 {np.percentile(latencies_ms, 50):.1f}  p95 {np.percentile(latencies_ms, 95):.1f}  "
+              f"p99 {np.percentile(latencies_ms, 99):.1f}  max {latencies_ms.max():.1f}")
+        print("service:", AggregateClient(args.dataset, address).stats())
+        connection_pool(address).close()
+    finally:
+        if service is not None:
+            service.terminate()
+            service.wait()
@@ -0,0 +1,462 @@
+import argparse
+import ipaddress
+import os
+import queue
+import secrets
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from data_validation import SCHEMAS
+from insurance_aggregates import AggregateMemo, compute_aggregates
+from insurance_dataset import Dataset, read_snapshot
+from insurance_query import answer_intent, compute_intent
+
+# Datasets the service can answer for: name -> (dataset directory, schema name, year files it ingests)
+DATASETS = {
+    'insurance_v2': (os.path.join('datasets', 'insurance_v2'), 'insurance_v2',
+                     ['insurance_data_v2_2020.csv', 'insurance_data_v2_2021.csv', 'insurance_data_v2_2022.csv']),
+    'insurance_xl2': (os.path.join('datasets', 'insurance_xl2'), 'insurance_xl2',
+                      ['insurance_data_xl2_2020.csv', 'insurance_data_xl2_2021.csv', 'insurance_data_xl2_2022.csv']),
+}
+
+# Worker processes by default: they share the rows, but each one still holds the filtered copies of its requests
+DEFAULT_WORKERS = min(os.cpu_count() or 1, 4)
+
+# "host:port" of a running service; when set, the dashboards send their queries to it
+SERVICE_ENV = 'AGGREGATE_SERVICE'
+SERVICE_KEY_ENV = 'AGGREGATE_SERVICE_KEY'
+DEFAULT_ADDRESS = ('localhost', 6070)
+
+# Without $AGGREGATE_SERVICE_KEY, the service generates a random key into this file (readable by its user only),
+# and the dashboards of the same user read it from there
+KEY_FILE = os.path.join(os.path.expanduser('~'), '.aggregate_service_key')
+
+
+# Function to parse a "host:port" address
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+# Function to get the shared secret that clients must present to the service: $AGGREGATE_SERVICE_KEY,
+# else the key file (which the service creates with a random key when `create` is set)
+def service_authkey(create=False):
+    key = os.environ.get(SERVICE_KEY_ENV)
+    if key:
+        return key.encode()
+    try:
+        with open(KEY_FILE, 'rb') as key_file:
+            return key_file.read().strip()
+    except FileNotFoundError:
+        if not create:
+            raise
+    key = secrets.token_hex(32).encode()
+    with os.fdopen(os.open(KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as key_file:
+        key_file.write(key)
+    return key
+
+
+# Function to tell whether a host name resolves to a loopback address (only this machine can connect)
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+# Function to describe a dataset for the dashboard sidebars (in the order the values first appear),
+# and how it stores money, so the dashboards can convert amounts for display
+def describe_rows(df, money='units'):
+    return {
+        'money': money,
+        'row_count': len(df),
+        'years': df['year'].unique().tolist(),
+        'insured_types': df['insured_type'].unique().tolist(),
+        'loss_ratio_range': (float(df['loss_ratio'].min()), float(df['loss_ratio'].max())) if len(df) else (0.0, 0.0),
+    }
+
+
+# Function to answer one request against a dataset's rows
+def answer_request(kind, df, args, money='units'):
+    if kind == 'describe':
+        return describe_rows(df, money)
+    if kind == 'aggregates':
+        return compute_aggregates(df, *args)
+    if kind == 'query':
+        return compute_intent(df, *args)
+    raise ValueError(f"unknown request kind {kind!r}")
+
+
+# --- Worker processes: each one memory-maps the snapshot of every dataset's current version,
+# so the rows are held once by the OS page cache however many workers there are ---
+
+_worker_datasets = {}
+_worker_rows = {}  # name -> (version, rows mapped from the snapshot)
+
+
+# Function to open the datasets in a worker process (runs once per worker)
+def init_worker(datasets):
+    for name, (root, schema_name, _) in datasets.items():
+        _worker_datasets[name] = Dataset(root, SCHEMAS[schema_name])
+
+
+# Function to answer a chunk of unique requests in a worker against the given {name: (version, snapshot path)};
+# returns (version, status, result) per request
+def run_requests(requests, snapshots):
+    replies = []
+    for kind, name, args in requests:
+        try:
+            dataset = _worker_datasets[name]
+            version, path = snapshots[name]
+            if kind == 'sketches':
+                # Merged from the stored sketches of the segments up to the version
+                dataset.refresh()
+                replies.append((version, 'ok', dataset.sketches(version)))
+                continue
+            if _worker_rows.get(name, (None,))[0] != version:
+                _worker_rows.pop(name, None)  # Unmap the previous version first
+                _worker_rows[name] = (version, read_snapshot(path))
+            replies.append((version, 'ok', answer_request(kind, _worker_rows[name][1], args, dataset.money)))
+        except Exception as error:  # Reported to the client instead of killing the worker
+            replies.append((None, 'error', f"{type(error).__name__}: {error}"))
+    return replies
+
+
+# Aggregate service: accepts dashboard connections on a local socket and answers their queries
+# on a pool of worker processes, so concurrent sessions do not serialize behind one GIL.
+# Requests arriving within `batch_window` seconds are batched: identical requests are computed once,
+# cached answers come from the memo, and the rest are split evenly across the workers
+class AggregateService:
+    def __init__(self, datasets=DATASETS, workers=None, batch_window=0.005, max_batch=256):
+        self.datasets = {name: Dataset(root, SCHEMAS[schema_name]) for name, (root, schema_name, _) in datasets.items()}
+        self.files = {name: files for name, (_, _, files) in datasets.items()}
+        self.workers = workers or DEFAULT_WORKERS
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker, initargs=(datasets,))
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.memo = AggregateMemo(max_entries=1024, max_bytes=256 * 1024 * 1024)
+        self.sketches = {}  # name -> (version, partition sketches)
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.requests_served = 0
+
+    # Function to accept connections until interrupted (one thread per open client connection).
+    # Requests are unpickled, so only a shared key set in $AGGREGATE_SERVICE_KEY may open the service to other hosts
+    def serve(self, address=DEFAULT_ADDRESS, authkey=None, ingest_interval=5.0):
+        if authkey is None and not os.environ.get(SERVICE_KEY_ENV) and not is_loopback(address[0]):
+            raise ValueError(f"refusing to listen on {address[0]} without ${SERVICE_KEY_ENV}; "
+                             f"set it (on the dashboards too) or listen on localhost")
+        authkey = authkey or service_authkey(create=True)
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+        if ingest_interval:
+            threading.Thread(target=self._ingest_loop, args=(ingest_interval,), daemon=True).start()
+        # The default backlog of 1 would drop the connections of sessions that start together
+        with Listener(address, backlog=128, authkey=authkey) as listener:
+            print(f"Aggregate service listening on {address[0]}:{address[1]} with {self.workers} workers")
+            try:
+                while True:
+                    try:
+                        connection = listener.accept()
+                    except (OSError, EOFError, AuthenticationError):
+                        continue  # A client failed the handshake
+                    threading.Thread(target=self._handle, args=(connection,), daemon=True).start()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                self.pool.shutdown(cancel_futures=True)
+
+    # Function to answer one connection's requests in order
+    def _handle(self, connection):
+        try:
+            while True:
+                request = connection.recv()
+                if request[0] == 'stats':
+                    connection.send(('ok', None, self.stats()))
+                    continue
+                reply = Future()
+                self.requests.put((request, reply))
+                connection.send(reply.result())
+        except (EOFError, OSError):
+            pass
+        finally:
+            connection.close()
+
+    # Function to ingest new or changed files of every dataset every `interval` seconds. With the service the
+    # dashboards do not ingest, so it is the one writer; each new version is snapshotted for the workers here,
+    # off the batch loop. The datasets are opened apart from the dispatcher's, whose refreshes never wait on an ingest
+    def _ingest_loop(self, interval):
+        writers = {name: Dataset(dataset.root, dataset.schema) for name, dataset in self.datasets.items()}
+        while True:
+            for name, dataset in writers.items():
+                try:
+                    dataset.ingest(self.files[name])
+                    dataset.snapshot()
+                except Exception as error:  # Retried on the next round
+                    print(f"Ingesting {name} failed: {type(error).__name__}: {error}")
+            time.sleep(interval)
+
+    # Function to collect requests into batches and dispatch them
+    def _batch_loop(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        self.batches += 1
+        self.requests_served += len(batch)
+
+        # Current version of each dataset in the batch (a cheap manifest read), so cached answers never go stale
+        versions = {}
+        for (kind, name, args), _ in batch:
+            if name not in versions and name in self.datasets:
+                self.datasets[name].refresh()
+                versions[name] = self.datasets[name].version
+
+        # Identical requests share one computation
+        waiting = {}
+        for request, reply in batch:
+            kind, name, args = request
+            if name not in versions:
+                reply.set_result(('error', None, f"unknown dataset {name!r}"))
+                continue
+            cached = self._cached(name, versions[name], kind, args)
+            if cached is not None:
+                reply.set_result(('ok', versions[name], cached))
+            else:
+                waiting.setdefault(request, []).append(reply)
+
+        # Snapshot of each dataset version the workers read (written by the ingest loop unless another process ingested)
+        snapshots = {}
+        for kind, name, args in list(waiting):
+            if name in snapshots:
+                continue
+            try:
+                snapshots[name] = (versions[name], self.datasets[name].snapshot())
+            except Exception as error:
+                for request in [request for request in waiting if request[1] == name]:
+                    for reply in waiting.pop(request):
+                        reply.set_result(('error', None, f"{type(error).__name__}: {error}"))
+
+        # Split the unique requests evenly across the workers (one task per worker amortizes the IPC)
+        unique = list(waiting)
+        chunk_size = -(-len(unique) // self.workers) if unique else 1
+        for start in range(0, len(unique), chunk_size):
+            chunk = unique[start:start + chunk_size]
+            future = self.pool.submit(run_requests, chunk, snapshots)
+            future.add_done_callback(lambda future, chunk=chunk: self._deliver(chunk, future, waiting))
+
+    def _deliver(self, chunk, future, waiting):
+        try:
+            replies = future.result()
+        except Exception as error:  # The worker process died
+            replies = [(None, 'error', f"{type(error).__name__}: {error}")] * len(chunk)
+        for (kind, name, args), (version, status, result) in zip(chunk, replies):
+            for reply in waiting[(kind, name, args)]:
+                reply.set_result((status, version, result))
+            if status == 'ok':
+                self._store(name, version, kind, args, result)
+
+    # Function to look up a cached answer (the sketches are kept apart from the memo, one per dataset version)
+    def _cached(self, name, version, kind, args):
+        if kind == 'sketches':
+            cached_version, sketches = self.sketches.get(name, (None, None))
+            return sketches if cached_version == version else None
+        return self.memo.get((name, version), (kind, args))
+
+    def _store(self, name, version, kind, args, result):
+        if kind == 'sketches':
+            self.sketches[name] = (version, result)
+        else:
+            self.memo.put((name, version), (kind, args), result)
+
+    # Function to return the memo and batching metrics
+    def stats(self):
+        stats = self.memo.stats()
+        stats['batches'] = self.batches
+        stats['requests'] = self.requests_served
+        stats['average_batch'] = self.requests_served / self.batches if self.batches else 0.0
+        return stats
+
+
+# Connections to the aggregate service, shared by every session of a process: a request borrows an idle
+# connection (opening one when none is idle) and gives it back, so sessions that end leave nothing open
+class ConnectionPool:
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None, max_idle=8):
+        self.address = address
+        self.authkey = authkey
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        try:
+            return Client(self.address, authkey=self.authkey or service_authkey())
+        except AuthenticationError as error:
+            raise ConnectionError(f"aggregate service at {self.address[0]}:{self.address[1]} rejected the key") from error
+
+    # Function to send one message and return the reply; raises ConnectionError when the service is unreachable
+    def request(self, message):
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+        # An idle connection may have been closed by a restarted service; it is retried once on a new one
+        for attempt in (connection, None):
+            connection = attempt or self._connect()
+            try:
+                connection.send(message)
+                reply = connection.recv()
+                break
+            except (EOFError, OSError) as error:
+                connection.close()
+                if attempt is None:
+                    raise ConnectionError(f"aggregate service at {self.address[0]}:{self.address[1]}: {error!r}") from error
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(connection)
+                return reply
+        connection.close()
+        return reply
+
+    # Function to close the idle connections
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# Function to get the process-wide connection pool of a service address
+def connection_pool(address):
+    with _pools_lock:
+        if address not in _pools:
+            _pools[address] = ConnectionPool(address)
+        return _pools[address]
+
+
+# Aggregate service answers for one dataset (one per dashboard session); connections come from the process's pool
+class AggregateClient:
+    remote = True
+    warning = None
+
+    def __init__(self, name, address=DEFAULT_ADDRESS, pool=None):
+        self.name = name
+        self.pool = pool or connection_pool(address)
+        self.version = None
+        self._describe = None
+        self._sketches = (None, None)
+
+    # Function to send one request and wait for its answer
+    def request(self, kind, *args):
+        status, version, result = self.pool.request((kind, self.name, args))
+        if status != 'ok':
+            raise RuntimeError(f"aggregate service: {result}")
+        return version, result
+
+    # Function to pick up the dataset's current version; returns it
+    def refresh(self):
+        self.version, self._describe = self.request('describe')
+        return self.version
+
+    def describe(self):
+        return self._describe
+
+    def aggregates(self, filters):
+        return self.request('aggregates', filters)[1]
+
+    def query(self, filters, intent):
+        return self.request('query', filters, intent)[1]['result']
+
+    # Function to get the quantile sketches (fetched once per dataset version)
+    def sketches(self):
+        if self._sketches[0] != self.version:
+            self._sketches = self.request('sketches')
+        return self._sketches[1]
+
+    def stats(self):
+        return self.request('stats')[1]
+
+
+# In-process counterpart of AggregateClient: answers from a DatasetView through a shared memo
+class LocalAggregates:
+    remote = False
+    warning = None  # Why the service is not used, when it was configured but unreachable
+
+    def __init__(self, name, view, memo):
+        self.name = name
+        self.view = view
+        self.memo = memo
+        self.rows = None
+        self.version = None
+
+    # Function to read any new segments; returns the dataset version
+    def refresh(self):
+        self.rows, self.version = self.view.current()
+        return self.version
+
+    def _get(self, kind, args, compute):
+        return self.memo.get_or_compute((self.name, self.version), (kind, args), compute)
+
+    def describe(self):
+        return self._get('describe', (), lambda: describe_rows(self.rows, self.view.dataset.money))
+
+    def aggregates(self, filters):
+        return self._get('aggregates', (filters,), lambda: compute_aggregates(self.rows, filters))
+
+    def query(self, filters, intent):
+        return answer_intent(self.memo, (self.name, self.version), self.rows, filters, intent)
+
+    # Function to merge the quantile sketches stored with the dataset's segments
+    # (the dashboards cache the result per dataset version for every session)
+    def sketches(self):
+        return self.view.dataset.sketches()
+
+    def stats(self):
+        return self.memo.stats()
+
+
+# Function to choose the backend of a dashboard: the service when $AGGREGATE_SERVICE is set and answers,
+# else in-process (with a `warning` to show when the service was configured but unreachable)
+def aggregate_backend(name, view, memo):
+    address = os.environ.get(SERVICE_ENV)
+    if address:
+        client = AggregateClient(name, parse_address(address))
+        try:
+            client.refresh()
+            return client
+        except (ConnectionError, OSError) as error:
+            backend = LocalAggregates(name, view, memo)
+            backend.warning = f"The aggregate service at {address} is unavailable ({error}); answering in this process."
+            return backend
+    return LocalAggregates(name, view, memo)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the dashboards' filter/groupby queries from a worker pool.")
+    parser.add_argument('--address', default=f"{DEFAULT_ADDRESS[0]}:{DEFAULT_ADDRESS[1]}", help="host:port to listen on")
+    parser.add_argument('--workers', type=int, help=f"worker processes (defaults to {DEFAULT_WORKERS})")
+    parser.add_argument('--batch-window', type=float, default=0.005, help="seconds to collect requests into a batch")
+    parser.add_argument('--ingest-interval', type=float, default=5.0,
+                        help="seconds between checks for new or changed year files (0 leaves ingesting to others)")
+    args = parser.parse_args()
+
+    # Stop like on Ctrl+C when terminated, so the worker pool is shut down too
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    AggregateService(workers=args.workers, batch_window=args.batch_window).serve(parse_address(args.address),
+                                                                                 ingest_interval=args.ingest_interval)
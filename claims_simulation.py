@@ -0,0 +1,78 @@
+import numpy as np
+
+
+# Function to turn a scalar or a {category: value} parameter into one value per row
+def per_row(value, by_column, num_rows):
+    if not isinstance(value, dict):
+        return np.full(num_rows, float(value))
+    # Look the value up through the categorical codes instead of mapping strings row by row
+    lookup = np.array([float(value[category]) for category in by_column.categories])
+    return lookup[by_column.codes]
+
+
+# Function to compute the expected claim count per policy (claim rate per insured unit times exposure)
+def expected_claims(params, columns, num_rows):
+    rate = per_row(params['rate'], columns.get(params.get('by')), num_rows)
+    return rate * columns[params['exposure']]
+
+
+# Function to compute the mean severity (cost per claim) per policy
+def mean_severity(params, columns, num_rows):
+    return per_row(params['mean'], columns.get(params.get('by')), num_rows)
+
+
+# Function to draw the number of claims per policy (Poisson, or negative binomial for over-dispersed counts)
+def sample_claim_counts(params, rng, columns, num_rows):
+    mean = expected_claims(params, columns, num_rows)
+    if params.get('distribution', 'poisson') == 'poisson':
+        return rng.poisson(mean)
+    # Negative binomial with mean `mean` and variance mean + mean**2 / dispersion
+    dispersion = params['dispersion']
+    return rng.negative_binomial(dispersion, dispersion / (dispersion + mean))
+
+
+# Function to draw `size` individual claim amounts with the given per-claim means
+def sample_severities(params, rng, means):
+    distribution = params.get('distribution', 'lognormal')
+    if distribution == 'lognormal':
+        sigma = params.get('sigma', 1.0)
+        # Choose mu so that E[X] = exp(mu + sigma**2 / 2) equals the requested mean
+        return rng.lognormal(np.log(means) - sigma ** 2 / 2, sigma)
+    if distribution == 'pareto':
+        alpha = params.get('alpha', 2.5)
+        # Pareto with minimum x_m has mean alpha * x_m / (alpha - 1)
+        return (rng.pareto(alpha, means.shape) + 1) * means * (alpha - 1) / alpha
+    raise ValueError(f"Unknown severity distribution: {distribution}")
+
+
+# Function to draw every claim of every policy and add them up per policy
+def sample_incurred(params, rng, columns, num_rows):
+    counts = columns[params['counts']]
+    total_claims = int(counts.sum())
+    incurred = np.zeros(num_rows)
+    if total_claims == 0:
+        return incurred
+
+    # One flat array of claim amounts, with each policy's claims stored next to each other
+    means = np.repeat(mean_severity(params, columns, num_rows), counts)
+    severities = sample_severities(params, rng, means)
+
+    # Sum each policy's slice in one call; policies without claims are skipped (their slice would be empty)
+    has_claims = counts > 0
+    starts = np.cumsum(counts) - counts
+    incurred[has_claims] = np.add.reduceat(severities, starts[has_claims])
+    return incurred
+
+
+# Function to price each policy: expected losses divided by the target loss ratio, with some noise
+def sample_premium(params, rng, columns, num_rows):
+    expected_losses = expected_claims(params['frequency'], columns, num_rows) * \
+        mean_severity(params['severity'], columns, num_rows)
+    spread = params.get('spread', 0.1)
+    return expected_losses / params['target_loss_ratio'] * rng.uniform(1 - spread, 1 + spread, num_rows)
+
+
+# Function to compute the underwriting result: premium less expenses less incurred losses
+def underwriting_profit(params, columns):
+    premium = columns[params['premium']]
+    return premium * (1 - params['expense_ratio']) - columns[params['losses']]
@@ -1,25 +1,32 @@
-import pandas as pd
+import os
 import time
 
+from data_validation import SCHEMAS
+from insurance_dataset import Dataset
+from money import from_cents
+
 # List of CSV files
 csv_files = ['insurance_data_2020.csv', 'insurance_data_2021.csv', 'insurance_data_2022.csv', 'insurance_data_2023.csv', 'insurance_data_2024.csv']
 
-# Variable to hold the total row count
-total_row_count = 0
+# Append-only dataset of the ingested files (see insurance_dataset.py): a file already in its manifest
+# is not read again, so adding insurance_data_2025.csv only processes that file
+dataset = Dataset(os.path.join('datasets', 'insurance_data'), SCHEMAS['insurance_v2'])
 
 start_time=time.time()
-# Define the chunk size (e.g., 1 million rows at a time)
-chunk_size = 1000000  # You can adjust this size based on your system's memory capacity
 
-# Loop through each CSV file and read in chunks
-for file in csv_files:
-    # Read each chunk from the CSV file
-    for chunk in pd.read_csv(file, chunksize=chunk_size):
-        # Add the number of rows in the current chunk to the total count
-        print("cc:", chunk)
-        total_row_count += len(chunk)
+# Ingest the new or changed files (each is read once, in chunks, and validated on the way)
+dataset.ingest(csv_files)
+
+# The totals are merged from the per-partition aggregates stored in the manifest
+partitions = dataset.partitions()
+total_row_count = int(partitions['row_count'].sum()) if not partitions.empty else 0
 
 print("total time:", time.time()-start_time)
 
-# Print the total row count
+# Print the totals per year and the total row count (sums of cents are exact; they are converted only to print)
+if not partitions.empty:
+    totals = partitions.groupby('year')[['row_count', 'total_gwp', 'total_profit']].sum()
+    if dataset.money == 'cents':
+        totals[['total_gwp', 'total_profit']] = from_cents(totals[['total_gwp', 'total_profit']])
+    print(totals)
 print(f"Total number of rows: {total_row_count}")
@@ -0,0 +1,148 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# JSONL file the per-rerun timings are appended to (disabled when the variable is not set)
+TIMING_LOG_ENV = 'DASHBOARD_TIMING_LOG'
+
+# Each Streamlit session runs its script on its own thread, so the current rerun is thread-local
+_local = threading.local()
+
+# What current_rss() measures: the current resident memory where /proc is available, otherwise the peak
+# resident memory, whose deltas only show how far a stage raised the peak
+RSS_KIND = 'current' if os.path.exists('/proc/self/statm') else 'peak'
+
+
+# Function to read the resident memory of this process in bytes, current or peak as RSS_KIND says
+# (None when it cannot be measured)
+def current_rss():
+    if RSS_KIND == 'current':
+        try:
+            with open('/proc/self/statm') as statm:
+                return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            return None
+    try:
+        import resource
+        # Peak RSS is the closest portable measure (kilobytes on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
+    except (ImportError, AttributeError):
+        return None
+
+
+# Timings of the stages of one script rerun
+class RerunTimer:
+    def __init__(self, app_name):
+        self.app_name = app_name
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._start_rss = current_rss()
+        self.stages = {}  # stage name -> {'seconds', 'calls', 'memory_delta'}
+        self.record = None
+
+    # Context manager timing one stage; repeated stages with the same name are summed
+    @contextmanager
+    def span(self, name):
+        rss_before = current_rss()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            rss_after = current_rss()
+            stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'memory_delta': 0})
+            stage['seconds'] += seconds
+            stage['calls'] += 1
+            if rss_before is not None and rss_after is not None:
+                stage['memory_delta'] += rss_after - rss_before
+
+    # Finish the rerun, returning the record and appending it to the JSONL log if enabled
+    def finish(self, log_path=None):
+        if self.record is not None:
+            return self.record
+
+        end_rss = current_rss()
+        self.record = {
+            'app': self.app_name,
+            'started_at': self.started_at,
+            'total_seconds': time.perf_counter() - self._start,
+            'memory_delta': end_rss - self._start_rss if end_rss is not None and self._start_rss is not None else None,
+            'memory_kind': RSS_KIND,
+            'stages': self.stages,
+        }
+
+        log_path = log_path or os.environ.get(TIMING_LOG_ENV)
+        if log_path:
+            with open(log_path, 'a') as log_file:
+                log_file.write(json.dumps(self.record) + '\n')
+        return self.record
+
+
+# Function to start timing a new rerun on the current thread
+def start_rerun(app_name):
+    _local.timer = RerunTimer(app_name)
+    return _local.timer
+
+
+# Function to get the timer of the current rerun (None outside a timed rerun)
+def current_timer():
+    return getattr(_local, 'timer', None)
+
+
+# Context manager timing a stage of the current rerun (does nothing outside a timed rerun)
+@contextmanager
+def span(name):
+    timer = current_timer()
+    if timer is None:
+        yield
+        return
+    with timer.span(name):
+        yield
+
+
+# Function to finish the current rerun (returns None outside a timed rerun)
+def finish_rerun(log_path=None):
+    timer = current_timer()
+    if timer is None:
+        return None
+    return timer.finish(log_path)
+
+
+# Function to show the timings of the current rerun in a collapsible debug panel
+def render_timing_panel(container=None):
+    import pandas as pd
+    import streamlit as st
+    from lazy_modules import import_times  # Imported here: lazy_modules itself imports this module
+
+    record = finish_rerun()
+    if record is None:
+        return
+
+    container = container or st
+    # Without /proc only the peak RSS is known, so the deltas are labelled as peak growth
+    memory_label = 'Memory delta' if record['memory_kind'] == 'current' else 'Peak RSS delta'
+    with container.expander("Rerun Timings"):
+        st.write(f"Total: {record['total_seconds'] * 1000:.1f} ms")
+        if record['memory_delta'] is not None:
+            st.write(f"{memory_label}: {record['memory_delta'] / (1024 * 1024):+.1f} MB")
+        stages = pd.DataFrame([
+            {
+                'Stage': name,
+                'Calls': stage['calls'],
+                'Time (ms)': round(stage['seconds'] * 1000, 1),
+                f'{memory_label} (MB)': round(stage['memory_delta'] / (1024 * 1024), 2),
+            }
+            for name, stage in record['stages'].items()
+        ])
+        st.table(stages)
+
+        # What each lazily imported module cost when this process first used it (0 when it was already imported)
+        if import_times:
+            st.write("Lazy imports (this process):")
+            st.table(pd.DataFrame([
+                {'Module': name, 'Import (ms)': round(seconds * 1000, 1)}
+                for name, seconds in import_times.items()
+            ]))
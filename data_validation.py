@@ -0,0 +1,199 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from insurance_generator import INSURED_GROUPS, INSURED_TYPES
+from ledger_timeseries import parse_dates
+from money import to_cents
+from transaction_stream import CATEGORIES
+
+# One validated column: its name, what it holds ('kind') and the checks' parameters
+# kinds: 'integer' / 'number' (optional 'low' / 'high' bounds), 'percent_label' ("NN %" strings, same bounds),
+# 'choice' ('values'), 'date' (see ledger_timeseries.DATE_FORMATS), 'text'; every column is required unless params has 'nullable'.
+# A 'number' column with 'money' in its params holds an amount of money
+ColumnRule = namedtuple('ColumnRule', ['name', 'kind', 'params'])
+
+# The checks of one file layout, the column whose values must not repeat within a file (if any),
+# and how the valid rows hold money: 'units' (float64) or 'cents' (int64, see money.py)
+Schema = namedtuple('Schema', ['name', 'columns', 'unique', 'money'], defaults=[None, 'units'])
+
+# Columns shared by the v2 and xl2 insurance files
+INSURANCE_COLUMNS = [
+    ColumnRule('sl', 'integer', {'low': 1}),
+    ColumnRule('insured_type', 'choice', {'values': INSURED_TYPES}),
+    ColumnRule('insured_group', 'choice', {'values': INSURED_GROUPS}),
+    ColumnRule('year', 'integer', {'low': 1900, 'high': 2100}),
+    ColumnRule('filter_loss_ratio', 'number', {'low': 0, 'high': 1}),
+    ColumnRule('profit', 'number', {'money': True}),  # Profit can be negative or positive
+    ColumnRule('insured', 'integer', {'low': 0}),
+    ColumnRule('gwp', 'number', {'low': 0, 'money': True}),
+    ColumnRule('claim_count', 'integer', {'low': 0}),
+]
+
+SCHEMAS = {
+    # insurance_data_v2_<year>.csv: loss_ratio is a fraction between 0 and 1
+    'insurance_v2': Schema('insurance_v2', INSURANCE_COLUMNS + [
+        ColumnRule('loss_ratio', 'number', {'low': 0, 'high': 1}),
+    ], unique='sl'),
+    # insurance_data_xl2_<year>.csv: loss_ratio is an "NN %" label (above 100 % when losses exceed premium)
+    'insurance_xl2': Schema('insurance_xl2', INSURANCE_COLUMNS + [
+        ColumnRule('total_incurred', 'number', {'low': 0, 'money': True}),
+        ColumnRule('loss_ratio', 'percent_label', {'low': 0}),
+    ], unique='sl'),
+    # Bank statements of the expense tracker
+    'bank_statement': Schema('bank_statement', [
+        ColumnRule('Date', 'date', {}),
+        ColumnRule('Description', 'text', {}),
+        ColumnRule('Category', 'choice', {'values': CATEGORIES}),
+        ColumnRule('Amount', 'number', {'low': 0, 'money': True}),  # The sign is carried by Dr/Cr
+        ColumnRule('Dr/Cr', 'choice', {'values': ['Dr', 'Cr']}),
+        ColumnRule('CustomerId', 'number', {'nullable': True}),
+    ]),
+}
+
+PERCENT_LABEL = r'^\s*-?\d+(\.\d+)?\s*%\s*$'
+
+
+# Tally of the violations found while reading, grouped by file, column and check
+class ValidationReport:
+    def __init__(self):
+        self.rows_checked = 0
+        self.rows_quarantined = 0
+        self.counts = {}  # (file, column, check) -> number of rows
+
+    # Function to count the violations of one check
+    def add(self, file, column, check, rows):
+        if rows:
+            key = (file, column, check)
+            self.counts[key] = self.counts.get(key, 0) + int(rows)
+
+    # Function to return the violations as a compact table (one row per file, column and check)
+    def summary(self):
+        rows = [(file, column, check, count) for (file, column, check), count in sorted(self.counts.items())]
+        return pd.DataFrame(rows, columns=['file', 'column', 'check', 'rows'])
+
+
+# Keys seen so far in one file, to find duplicates across chunks without keeping the rows
+class KeyTracker:
+    # Keys below this are marked in a bitmap sized to the largest key seen (1 byte per key, 256 MB at most);
+    # negative or larger keys (far too sparse for a bitmap) go to a set
+    max_bitmap_key = 1 << 28
+
+    def __init__(self):
+        self.bitmap = np.zeros(0, dtype=bool)
+        self.overflow = set()
+
+    # Function to flag the keys already seen (in earlier chunks or earlier in this chunk), then record them
+    def duplicates(self, keys):
+        keys = np.asarray(keys, dtype=np.int64)
+        duplicated = pd.Series(keys).duplicated().to_numpy(copy=True)
+
+        small = (keys >= 0) & (keys < self.max_bitmap_key)
+        if small.any():
+            needed = int(keys[small].max()) + 1
+            if needed > len(self.bitmap):
+                # Grow by doubling, like the spend store's buckets
+                bitmap = np.zeros(min(max(needed, 2 * len(self.bitmap)), self.max_bitmap_key), dtype=bool)
+                bitmap[:len(self.bitmap)] = self.bitmap
+                self.bitmap = bitmap
+            duplicated[small] |= self.bitmap[keys[small]]
+            self.bitmap[keys[small]] = True
+        if not small.all():
+            large = keys[~small].tolist()
+            duplicated[~small] |= np.array([key in self.overflow for key in large], dtype=bool)
+            self.overflow.update(large)
+        return duplicated
+
+
+# Function to convert a column of strings to numbers (NaN where it does not parse)
+def to_number(column, integer=False):
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        try:
+            # Fast path: the whole chunk parses
+            values = pc.cast(column, pa.int64() if integer else pa.float64()).to_numpy(zero_copy_only=False)
+            return values.astype(float)
+        except pa.ArrowInvalid:
+            return pd.to_numeric(column.to_pandas(), errors='coerce').to_numpy(dtype=float)
+    return column.to_numpy(zero_copy_only=False).astype(float)
+
+
+# Function to check one chunk (a pyarrow table, text columns as strings) against the schema in vectorized passes.
+# Returns the valid rows with numbers parsed, and the quarantined rows as read plus a 'violation' column
+def validate_chunk(table, schema, file, report, tracker=None):
+    num_rows = table.num_rows
+    violations = np.full(num_rows, '', dtype=object)
+    # Numeric columns are parsed by their checks below; the rest are converted as read
+    numeric = {rule.name for rule in schema.columns if rule.kind in ('integer', 'number', 'percent_label')}
+    columns = {name: None if name in numeric else table.column(name).to_pandas() for name in table.column_names}
+
+    # Function to record the rows failing one check
+    def flag(column, check, failed):
+        failed = np.asarray(failed, dtype=bool)
+        count = int(failed.sum())
+        if count:
+            report.add(file, column, check, count)
+            label = f'{column}: {check}'
+            violations[failed] = np.where(violations[failed] == '', label, violations[failed] + ', ' + label)
+
+    for rule in schema.columns:
+        if rule.name not in columns:
+            flag(rule.name, 'missing column', np.ones(num_rows, dtype=bool))
+            continue
+        column = table.column(rule.name)
+        missing = column.is_null().to_numpy(zero_copy_only=False)
+        if not rule.params.get('nullable'):
+            flag(rule.name, 'null', missing)
+
+        if rule.kind in ('integer', 'number', 'percent_label'):
+            if rule.kind == 'percent_label':
+                if pa.types.is_string(column.type):
+                    labelled = pc.fill_null(pc.match_substring_regex(column, PERCENT_LABEL), False).to_numpy(zero_copy_only=False)
+                    flag(rule.name, 'malformed "NN %"', ~labelled & ~missing)
+                    column = pc.replace_substring(column, '%', '')
+                    values = to_number(pc.utf8_trim_whitespace(column))
+                else:
+                    values = to_number(column)
+            else:
+                values = to_number(column, integer=rule.kind == 'integer')
+                flag(rule.name, 'not a number', np.isnan(values) & ~missing)
+                if rule.kind == 'integer':
+                    flag(rule.name, 'not an integer', ~np.isnan(values) & (values != np.floor(values)))
+            with np.errstate(invalid='ignore'):
+                if 'low' in rule.params:
+                    flag(rule.name, f"below {rule.params['low']}", values < rule.params['low'])
+                if 'high' in rule.params:
+                    flag(rule.name, f"above {rule.params['high']}", values > rule.params['high'])
+            columns[rule.name] = pd.Series(values, name=rule.name)
+        elif rule.kind == 'choice':
+            known = pc.is_in(column.cast(pa.string()), pa.array(rule.params['values'])).to_numpy(zero_copy_only=False)
+            flag(rule.name, 'unknown value', ~known & ~missing)
+        elif rule.kind == 'date':
+            flag(rule.name, 'unparseable date', parse_dates(columns[rule.name]).isna().to_numpy() & ~missing)
+
+    if schema.unique and tracker is not None and schema.unique in columns:
+        keys = columns[schema.unique].to_numpy(dtype=float)
+        known = ~np.isnan(keys)
+        duplicated = np.zeros(num_rows, dtype=bool)
+        duplicated[known] = tracker.duplicates(keys[known])
+        flag(schema.unique, 'duplicate', duplicated)
+
+    bad = violations != ''
+    report.rows_checked += num_rows
+    report.rows_quarantined += int(bad.sum())
+    df = pd.DataFrame(columns)
+    if bad.any():
+        df = df[~bad].reset_index(drop=True)
+
+    # Integer columns hold no nulls once the bad rows are gone, and neither do money columns kept in cents
+    for rule in schema.columns:
+        if rule.name not in df or rule.params.get('nullable'):
+            continue
+        if rule.kind == 'integer':
+            df[rule.name] = df[rule.name].astype(np.int64)
+        elif rule.params.get('money') and schema.money == 'cents':
+            df[rule.name] = to_cents(df[rule.name])
+    quarantined = table.filter(pa.array(bad)).to_pandas().assign(violation=violations[bad])
+    return df, quarantined
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+
+from heavy_hitters import HeavyHitters
+from ledger_timeseries import parse_timestamps
+from money import from_cents, sum_cents_by, to_cents
+
+# Heatmap column that sums the descriptions outside the top ones
+OTHER_COLUMN = '(other)'
+
+# Columns of the expense ledger, in the order of the bank statement files
+COLUMNS = ['Date', 'Description', 'Category', 'Amount', 'Dr/Cr', 'CustomerId']
+
+
+# Dictionary of interned strings: each distinct string is stored once and rows hold its integer code
+class StringDictionary:
+    def __init__(self):
+        self.values = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    # Function to encode a batch of strings to codes, adding codes for unseen strings
+    def encode(self, strings):
+        codes, uniques = pd.factorize(np.asarray(strings, dtype=object), use_na_sentinel=False)
+        mapping = np.empty(len(uniques), dtype=np.int32)
+        for position, value in enumerate(uniques):
+            value = '' if pd.isna(value) else str(value)  # Missing text is stored as an empty string
+            if value not in self.index:
+                self.index[value] = len(self.values)
+                self.values.append(value)
+            mapping[position] = self.index[value]
+        return mapping[codes]
+
+    # Function to decode codes back to their strings
+    def decode(self, codes):
+        return np.asarray(self.values, dtype=object)[codes]
+
+    # Function to wrap codes as a pandas Categorical over the dictionary (the strings are not copied per row)
+    def categorical(self, codes):
+        return pd.Categorical.from_codes(codes, categories=pd.Index(self.values, dtype=object))
+
+
+# Column store of the expense ledger: the text columns (Description, Category, Dr/Cr) as dictionary codes,
+# Date as datetime64 (live timestamps are nearly all distinct, so a dictionary would not share them)
+# and Amount as int64 cents. It is the only copy of the ledger; frame() shows it as a DataFrame of categoricals.
+# Groupings run on the integer codes with exact integer sums (converted to units only in the results),
+# and a heavy-hitters summary keeps the top descriptions by amount, so the heatmap stays bounded
+# however many distinct descriptions the ledger holds
+class ExpenseStore:
+    def __init__(self, capacity_rows=1024, tracked_descriptions=64):
+        self.descriptions = StringDictionary()
+        self.categories = StringDictionary()
+        self.directions = StringDictionary()  # Dr/Cr
+        self.dates = np.zeros(capacity_rows, dtype='datetime64[ns]')
+        self.description_codes = np.zeros(capacity_rows, dtype=np.int32)
+        self.category_codes = np.zeros(capacity_rows, dtype=np.int32)
+        self.direction_codes = np.zeros(capacity_rows, dtype=np.int32)
+        self.amounts = np.zeros(capacity_rows, dtype=np.int64)  # In cents
+        self.customer_ids = np.zeros(capacity_rows, dtype=float)
+        self.num_rows = 0
+        self.top_descriptions = HeavyHitters(tracked_descriptions)
+
+    def __len__(self):
+        return self.num_rows
+
+    # Function to grow the columns (doubling) so they hold at least `num_rows` rows
+    def reserve(self, num_rows):
+        capacity = len(self.amounts)
+        if num_rows <= capacity:
+            return
+        while capacity < num_rows:
+            capacity *= 2
+        for name in ('dates', 'description_codes', 'category_codes', 'direction_codes', 'amounts', 'customer_ids'):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.num_rows] = column[:self.num_rows]
+            setattr(self, name, grown)
+
+    # Function to append transactions (a DataFrame with the COLUMNS of the ledger)
+    def append(self, transactions):
+        count = len(transactions)
+        if count == 0:
+            return
+        self.reserve(self.num_rows + count)
+        rows = slice(self.num_rows, self.num_rows + count)
+        self.dates[rows] = parse_timestamps(transactions['Date']).to_numpy()
+        self.description_codes[rows] = self.descriptions.encode(transactions['Description'].to_numpy())
+        self.category_codes[rows] = self.categories.encode(transactions['Category'].to_numpy())
+        self.direction_codes[rows] = self.directions.encode(transactions['Dr/Cr'].to_numpy())
+        self.amounts[rows] = to_cents(pd.to_numeric(transactions['Amount'], errors='coerce').fillna(0))
+        self.customer_ids[rows] = pd.to_numeric(transactions['CustomerId'], errors='coerce')
+        self.top_descriptions.add(self.description_codes[rows], np.abs(self.amounts[rows]))
+        self.num_rows += count
+
+    # Function to remove the last `count` rows (e.g. when the last expense is deleted)
+    def remove_last(self, count=1):
+        count = min(count, self.num_rows)
+        rows = slice(self.num_rows - count, self.num_rows)
+        self.top_descriptions.remove(self.description_codes[rows], np.abs(self.amounts[rows]))
+        self.num_rows -= count
+
+    # Function to return rows `start` to `stop` (all rows by default) as a DataFrame; the text columns are
+    # categoricals over the store's dictionaries, Date is datetime64 and Amount is in units
+    def frame(self, start=0, stop=None):
+        rows = slice(start, self.num_rows if stop is None else min(stop, self.num_rows))
+        return pd.DataFrame({
+            'Date': self.dates[rows],
+            'Description': self.descriptions.categorical(self.description_codes[rows]),
+            'Category': self.categories.categorical(self.category_codes[rows]),
+            'Amount': from_cents(self.amounts[rows]),
+            'Dr/Cr': self.directions.categorical(self.direction_codes[rows]),
+            'CustomerId': self.customer_ids[rows],
+        }, columns=COLUMNS)
+
+    # Function to return the total amount per category (sorted by name, like a groupby)
+    def totals_by_category(self):
+        totals = sum_cents_by(self.category_codes[:self.num_rows], self.amounts[:self.num_rows], len(self.categories))
+        return pd.Series(from_cents(totals), index=pd.Index(self.categories.values, name='Category'), name='Amount').sort_index()
+
+    # Function to build the Category x Description amount matrix for the `top_k` heaviest descriptions,
+    # with the remaining descriptions summed into one OTHER_COLUMN
+    def heatmap(self, top_k=15):
+        top_codes, _ = self.top_descriptions.top(top_k)
+
+        # Column of every description code in the matrix: its rank among the top ones, or the last (other) column
+        columns = np.full(len(self.descriptions), len(top_codes), dtype=np.int64)
+        columns[top_codes] = np.arange(len(top_codes))
+        num_columns = len(top_codes) + 1
+
+        cells = self.category_codes[:self.num_rows].astype(np.int64) * num_columns + columns[self.description_codes[:self.num_rows]]
+        values = from_cents(sum_cents_by(cells, self.amounts[:self.num_rows], len(self.categories) * num_columns))
+        matrix = pd.DataFrame(values.reshape(len(self.categories), num_columns),
+                              index=pd.Index(self.categories.values, name='Category'),
+                              columns=list(self.descriptions.decode(top_codes)) + [OTHER_COLUMN])
+
+        # Only categories with rows, and the other column only when some description falls into it
+        used = np.bincount(self.category_codes[:self.num_rows], minlength=len(self.categories)) > 0
+        matrix = matrix[used].sort_index()
+        if not matrix[OTHER_COLUMN].any():
+            matrix = matrix.drop(columns=OTHER_COLUMN)
+        return matrix
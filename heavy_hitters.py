@@ -0,0 +1,50 @@
+import numpy as np
+
+
+# Weighted Misra-Gries heavy-hitters summary over integer keys, holding at most `capacity` counters.
+# Any key whose total weight exceeds total_weight / (capacity + 1) is kept, and every kept count
+# underestimates the true total by at most that much. Batches are merged in one vectorized step.
+class HeavyHitters:
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0)
+        self.total_weight = 0.0
+
+    # Function to add a batch of keys with their (non-negative) weights
+    def add(self, keys, weights=None):
+        keys = np.asarray(keys, dtype=np.int64)
+        if len(keys) == 0:
+            return
+        weights = np.ones(len(keys)) if weights is None else np.asarray(weights, dtype=float)
+        self.total_weight += float(weights.sum())
+
+        # The batch's exact totals per key form a summary too; merge it with the stored counters
+        all_keys, codes = np.unique(np.concatenate([self.keys, keys]), return_inverse=True)
+        counts = np.bincount(codes, weights=np.concatenate([self.counts, weights]), minlength=len(all_keys))
+
+        if len(all_keys) > self.capacity:
+            # Subtract the (capacity + 1)-th largest count from every counter and keep the positive ones
+            threshold = np.partition(counts, len(counts) - self.capacity - 1)[len(counts) - self.capacity - 1]
+            counts = counts - threshold
+        kept = counts > 0
+        self.keys, self.counts = all_keys[kept], counts[kept]
+
+    # Function to take weight away from keys again (e.g. when an expense is deleted)
+    def remove(self, keys, weights=None):
+        keys = np.asarray(keys, dtype=np.int64)
+        weights = np.ones(len(keys)) if weights is None else np.asarray(weights, dtype=float)
+        self.total_weight -= float(weights.sum())
+        if len(self.keys) == 0:
+            return
+        # The stored keys are sorted, so tracked keys are found by binary search
+        slots = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        tracked = self.keys[slots] == keys
+        np.subtract.at(self.counts, slots[tracked], weights[tracked])
+        kept = self.counts > 0
+        self.keys, self.counts = self.keys[kept], self.counts[kept]
+
+    # Function to return the (at most k) heaviest keys, heaviest first, with their estimated weights
+    def top(self, k):
+        order = np.argsort(-self.counts, kind='stable')[:k]
+        return self.keys[order], self.counts[order]
@@ -0,0 +1,337 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from dashboard_timing import span
+from money import MONEY_COLUMNS, from_cents
+from quantile_sketch import QuantileSketch
+
+# Aggregates that are amounts of money: scalars, and the money columns of the aggregate frames
+MONEY_AGGREGATES = ['total_profit', 'total_loss', 'total_insured_profit', 'total_gwp']
+MONEY_FRAME_COLUMNS = {'preview': MONEY_COLUMNS, 'yearly_summary': ['total_gwp'], 'profit_loss_by_type': ['Profit', 'Loss']}
+
+
+# Function to turn the sidebar selections into a hashable, order-independent key
+def normalize_filters(year_filter, insured_type_filter, loss_ratio_filter):
+    years = tuple(sorted(int(year) for year in year_filter))
+    insured_types = tuple(sorted(str(insured_type) for insured_type in insured_type_filter))
+    loss_ratio_range = (float(loss_ratio_filter[0]), float(loss_ratio_filter[1]))
+    return years, insured_types, loss_ratio_range
+
+
+# Function to apply the normalized filters to the DataFrame
+def apply_filters(df, filters):
+    years, insured_types, (loss_ratio_low, loss_ratio_high) = filters
+    return df[
+        (df['year'].isin(years)) &
+        (df['insured_type'].isin(insured_types)) &
+        (df['loss_ratio'] >= loss_ratio_low) &
+        (df['loss_ratio'] <= loss_ratio_high)
+    ]
+
+
+# Function to compute every aggregate the dashboard shows for one filter combination
+def compute_aggregates(df, filters):
+    with span('filter'):
+        filtered_df = apply_filters(df, filters)
+    profit = filtered_df['profit']
+
+    with span('groupby'):
+        # Calculate total profit and loss by insured type (losses are summed, then made positive)
+        profit_by_type = filtered_df[profit > 0].groupby('insured_type')['profit'].sum()
+        loss_by_type = filtered_df[profit < 0].groupby('insured_type')['profit'].sum().abs()
+        profit_loss_by_type = pd.DataFrame({
+            'Profit': profit_by_type,
+            'Loss': loss_by_type
+        }).fillna(0)  # Fill NaN with 0 for types without profit or loss
+
+        # Calculate total GWP and average loss ratio for each year
+        yearly_summary = filtered_df.groupby('year').agg(
+            total_gwp=('gwp', 'sum'),
+            average_loss_ratio=('loss_ratio', 'mean')
+        ).reset_index()
+
+    return {
+        'row_count': len(filtered_df),
+        'preview': filtered_df.head(),  # Only the first rows, never the full filtered frame
+        'total_insured': filtered_df['insured'].sum(),
+        'total_profit': profit.sum(),
+        'total_loss': profit[profit < 0].sum(),  # Total loss (negative profit)
+        'total_insured_profit': profit[profit > 0].sum(),
+        'total_gwp': filtered_df['gwp'].sum(),
+        'average_loss_ratio': filtered_df['loss_ratio'].mean(),
+        'yearly_summary': yearly_summary,
+        'profit_loss_by_type': profit_loss_by_type,
+    }
+
+
+# Function to compute additive aggregates per (year, insured_type) partition in one pass over the data
+def partition_aggregates(df):
+    profit = df['profit']
+    with span('groupby'):
+        parts = df.assign(
+            profit_gain=profit.where(profit > 0, 0),
+            profit_loss=profit.where(profit < 0, 0),
+        ).groupby(['year', 'insured_type']).agg(
+            row_count=('gwp', 'size'),
+            total_insured=('insured', 'sum'),
+            total_profit=('profit', 'sum'),
+            total_loss=('profit_loss', 'sum'),
+            total_insured_profit=('profit_gain', 'sum'),
+            total_gwp=('gwp', 'sum'),
+            loss_ratio_sum=('loss_ratio', 'sum'),
+        )
+    return parts.reset_index()
+
+
+# Function to merge partition aggregates (e.g. of several ingested files) by summing them per partition;
+# `signs` of -1 subtract a frame instead (rows that a correction replaces), and `drop_empty` removes
+# partitions left without rows
+def merge_partitions(parts_list, signs=None, drop_empty=False):
+    signs = signs or [1] * len(parts_list)
+    frames = []
+    for parts, sign in zip(parts_list, signs):
+        values = parts.set_index(['year', 'insured_type'])
+        frames.append(values * sign)
+    if not frames:
+        return pd.DataFrame(columns=['year', 'insured_type', 'row_count', 'total_insured', 'total_profit', 'total_loss',
+                                     'total_insured_profit', 'total_gwp', 'loss_ratio_sum'])
+    merged = pd.concat(frames).groupby(level=['year', 'insured_type']).sum()
+    if drop_empty:
+        merged = merged[merged['row_count'] != 0]
+    return merged.reset_index()
+
+
+# Function to combine partition aggregates for the selected years and insured types
+# (returns the same aggregates as compute_aggregates, without the row preview)
+def combine_partitions(parts, years, insured_types):
+    selected = parts[parts['year'].isin(years) & parts['insured_type'].isin(insured_types)]
+    row_count = int(selected['row_count'].sum())
+
+    by_year = selected.groupby('year')[['total_gwp', 'loss_ratio_sum', 'row_count']].sum()
+    yearly_summary = pd.DataFrame({
+        'year': by_year.index,
+        'total_gwp': by_year['total_gwp'].to_numpy(),
+        'average_loss_ratio': (by_year['loss_ratio_sum'] / by_year['row_count']).to_numpy(),
+    })
+
+    by_type = selected.groupby('insured_type')[['total_insured_profit', 'total_loss']].sum()
+    profit_loss_by_type = pd.DataFrame({
+        'Profit': by_type['total_insured_profit'],
+        'Loss': by_type['total_loss'].abs()
+    })
+
+    return {
+        'row_count': row_count,
+        'total_insured': selected['total_insured'].sum(),
+        'total_profit': selected['total_profit'].sum(),
+        'total_loss': selected['total_loss'].sum(),
+        'total_insured_profit': selected['total_insured_profit'].sum(),
+        'total_gwp': selected['total_gwp'].sum(),
+        'average_loss_ratio': selected['loss_ratio_sum'].sum() / row_count if row_count else np.nan,
+        'yearly_summary': yearly_summary,
+        'profit_loss_by_type': profit_loss_by_type,
+    }
+
+
+# Function to convert aggregates (of compute_aggregates or combine_partitions) to currency units for display.
+# Aggregates of a dataset that stores money in cents are exact integer sums until this point
+def aggregates_in_units(aggregates, money):
+    if money != 'cents':
+        return aggregates
+    converted = dict(aggregates)
+    for key in MONEY_AGGREGATES:
+        converted[key] = from_cents(aggregates[key])
+    for key, columns in MONEY_FRAME_COLUMNS.items():
+        if key in aggregates:
+            frame = aggregates[key].copy()
+            for column in frame.columns.intersection(columns):
+                frame[column] = from_cents(frame[column])
+            converted[key] = frame
+    return converted
+
+
+# Function to estimate the memory used by one set of aggregates (in bytes)
+def aggregates_nbytes(aggregates):
+    nbytes = 0
+    for value in aggregates.values():
+        if isinstance(value, pd.DataFrame):
+            nbytes += int(value.memory_usage(index=True, deep=True).sum())
+        elif isinstance(value, pd.Series):
+            nbytes += int(value.memory_usage(index=True, deep=True))
+        else:
+            nbytes += 64  # Scalars are small; count a fixed overhead
+    return nbytes
+
+
+# Bounded LRU memo of computed aggregates, keyed on (dataset key, normalized filters).
+# Dataset keys carry the dataset version, so new data never hits stale entries; those age out of the LRU
+class AggregateMemo:
+    def __init__(self, max_entries=64, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (aggregates, nbytes)
+        self._lock = threading.Lock()  # The memo is shared by every session's script thread
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.current_bytes = 0
+
+    # Return the cached aggregates for the key, computing and storing them on a miss
+    def get_or_compute(self, dataset_key, filters, compute):
+        aggregates = self.get(dataset_key, filters)
+        if aggregates is None:
+            # Compute outside the lock so other sessions are not blocked
+            aggregates = compute()
+            self.put(dataset_key, filters, aggregates)
+        return aggregates
+
+    # Return the cached aggregates for the key (None on a miss)
+    def get(self, dataset_key, filters):
+        key = (dataset_key, filters)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    # Store computed aggregates for the key
+    def put(self, dataset_key, filters, aggregates):
+        key = (dataset_key, filters)
+        nbytes = aggregates_nbytes(aggregates)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (aggregates, nbytes)
+                self.current_bytes += nbytes
+                self._evict()
+
+    # Drop least recently used entries until both the entry and size limits hold
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes):
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self.current_bytes -= nbytes
+            self.evictions += 1
+
+    # Return the hit/miss metrics for display
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Quantile sketches per (year, insured_type) partition, built for each file when it is ingested
+PartitionSketches = namedtuple('PartitionSketches', ['partitions', 'sketches'])
+
+# Percentiles shown in the percentile tables
+PERCENTILES = [0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+
+# Function to build mergeable quantile sketches of the given metrics for every (year, insured_type) partition
+def build_partition_sketches(df, metrics=('loss_ratio', 'profit')):
+    with span('sketch'):
+        partition_codes, partitions = pd.MultiIndex.from_frame(df[['year', 'insured_type']]).factorize()
+        sketches = {}
+        for metric in metrics:
+            sketch = QuantileSketch(num_keys=len(partitions))
+            sketch.add(partition_codes, df[metric].to_numpy(dtype=float))
+            sketches[metric] = sketch
+    return PartitionSketches([(int(year), str(insured_type)) for year, insured_type in partitions], sketches)
+
+
+# Function to merge partition sketches (e.g. of several ingested files) partition by partition;
+# `signs` of -1 subtract a set of sketches instead (rows that a correction replaces), and `drop_empty`
+# removes partitions left without values
+def merge_partition_sketches(sketches_list, signs=None, metrics=('loss_ratio', 'profit'), drop_empty=False):
+    signs = signs or [1] * len(sketches_list)
+    partitions = list(dict.fromkeys(partition for sketches in sketches_list for partition in sketches.partitions))
+    codes = {partition: code for code, partition in enumerate(partitions)}
+    merged = {}
+    for metric in metrics:
+        sketch = QuantileSketch(num_keys=len(partitions))
+        for sketches, sign in zip(sketches_list, signs):
+            sketch.merge(sketches.sketches[metric], [codes[partition] for partition in sketches.partitions], sign)
+        merged[metric] = sketch
+    if drop_empty and metrics:
+        used = [code for code in range(len(partitions)) if merged[metrics[0]].count([code])]
+        for sketch in merged.values():
+            sketch.positive, sketch.negative, sketch.zero = sketch.positive[used], sketch.negative[used], sketch.zero[used]
+        partitions = [partitions[code] for code in used]
+    return PartitionSketches(partitions, merged)
+
+
+# Function to save partition sketches to a .npz file (bucket counts of every metric, and the partitions they cover)
+def save_partition_sketches(path, partition_sketches):
+    arrays = {
+        'years': np.array([year for year, _ in partition_sketches.partitions], dtype=np.int64),
+        'insured_types': np.array([insured_type for _, insured_type in partition_sketches.partitions], dtype=str),
+    }
+    for metric, sketch in partition_sketches.sketches.items():
+        arrays[f'{metric}.positive'] = sketch.positive
+        arrays[f'{metric}.negative'] = sketch.negative
+        arrays[f'{metric}.zero'] = sketch.zero
+    np.savez_compressed(path, **arrays)
+
+
+# Function to load partition sketches saved by save_partition_sketches
+def load_partition_sketches(path):
+    with np.load(path) as arrays:
+        partitions = [(int(year), str(insured_type)) for year, insured_type in zip(arrays['years'], arrays['insured_types'])]
+        sketches = {}
+        for name in arrays.files:
+            metric, _, field = name.rpartition('.')
+            if field == 'positive':
+                sketch = QuantileSketch()
+                sketch.positive, sketch.negative, sketch.zero = arrays[name], arrays[f'{metric}.negative'], arrays[f'{metric}.zero']
+                sketches[metric] = sketch
+    return PartitionSketches(partitions, sketches)
+
+
+# Function to find the partitions inside the selected years and insured types
+def selected_partitions(partition_sketches, years, insured_types):
+    return [
+        code for code, (year, insured_type) in enumerate(partition_sketches.partitions)
+        if year in years and insured_type in insured_types
+    ]
+
+
+# Function to tabulate percentiles of a metric per year or per insured type, merging the selected partitions
+def percentile_table(partition_sketches, metric, years, insured_types, by='year'):
+    sketch = partition_sketches.sketches[metric]
+    group_values = sorted(years) if by == 'year' else sorted(insured_types)
+    rows = {}
+    for value in group_values:
+        codes = selected_partitions(partition_sketches, [value] if by == 'year' else years,
+                                    [value] if by == 'insured_type' else insured_types)
+        if codes:
+            rows[str(value)] = sketch.quantiles(PERCENTILES, codes)
+
+    # Overall row for the whole selection
+    codes = selected_partitions(partition_sketches, years, insured_types)
+    if codes:
+        rows['All'] = sketch.quantiles(PERCENTILES, codes)
+
+    table = pd.DataFrame.from_dict(rows, orient='index', columns=[f"p{int(q * 100)}" for q in PERCENTILES])
+    table.index.name = by
+    return table
+
+
+# Function to build a histogram of a metric over the selected partitions from the sketch buckets
+def sketch_histogram(partition_sketches, metric, years, insured_types, bins=30):
+    codes = selected_partitions(partition_sketches, years, insured_types)
+    values, counts = partition_sketches.sketches[metric].histogram(codes)
+    if len(values) == 0:
+        return np.array([]), np.array([])
+    counts, edges = np.histogram(values, bins=bins, weights=counts)
+    return counts, edges
@@ -0,0 +1,64 @@
+from lazy_modules import lazy_import
+
+# Chart backends are imported on first use, so they do not slow down process start
+# (the report job selects its headless backend before the first chart is drawn)
+plt = lazy_import('matplotlib.pyplot')
+sns = lazy_import('seaborn')
+
+
+# Function to draw the year-wise GWP pie chart from the aggregates of the selected data
+def plot_yearly_gwp(aggregates):
+    yearly_gwp = aggregates['yearly_summary'].set_index('year')['total_gwp']
+    fig, ax = plt.subplots()
+    ax.pie(yearly_gwp, labels=yearly_gwp.index, autopct='%1.1f%%', startangle=90,
+           colors=sns.color_palette("Set3", len(yearly_gwp)))
+    ax.set_title("Year-wise GWP")
+    return fig
+
+
+# Function to draw the year-wise average loss ratio pie chart
+def plot_yearly_loss_ratio(aggregates):
+    # Ensure loss_ratio is formatted correctly for the pie chart
+    yearly_loss_ratio = aggregates['yearly_summary'].set_index('year')['average_loss_ratio'].round(1)
+    fig, ax = plt.subplots()
+    ax.pie(yearly_loss_ratio, labels=yearly_loss_ratio.index, autopct='%1.1f%%', startangle=90,
+           colors=sns.color_palette("Set3", len(yearly_loss_ratio)))
+    ax.set_title("Year-wise Loss Ratio")
+    return fig
+
+
+# Function to draw the profit and loss by insured type grouped bar chart
+def plot_profit_loss_by_type(aggregates):
+    profit_loss_by_type = aggregates['profit_loss_by_type']
+
+    # Define width for each bar
+    bar_width = 0.35
+
+    # Define position for each bar group
+    r1 = range(len(profit_loss_by_type))  # Positions for profit bars
+    r2 = [x + bar_width for x in r1]  # Positions for loss bars (offset)
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+
+    # Plot the profit and loss bars side-by-side
+    ax.bar(r1, profit_loss_by_type['Profit'], color='#2ca02c', width=bar_width, edgecolor='grey', label='Profit')
+    ax.bar(r2, profit_loss_by_type['Loss'], color='#d62728', width=bar_width, edgecolor='grey', label='Loss')
+
+    # Add x-ticks in the middle of the two bars
+    ax.set_xticks([r + bar_width / 2 for r in r1])
+    ax.set_xticklabels(profit_loss_by_type.index)
+
+    # Set chart title and labels
+    ax.set_title("Profit and Loss by Insured Type")
+    ax.set_ylabel("Amount")
+    ax.set_xlabel("Insured Type")
+
+    # Add value labels on bars
+    for i in range(len(profit_loss_by_type)):
+        for positions, column in ((r1, 'Profit'), (r2, 'Loss')):
+            ax.annotate(f'${profit_loss_by_type[column].iloc[i]:,.2f}',
+                        xy=(positions[i], profit_loss_by_type[column].iloc[i]),
+                        xytext=(0, 5),  # 5 points vertical offset
+                        textcoords='offset points',
+                        ha='center', va='bottom', color='black')
+    return fig
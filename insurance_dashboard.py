@@ -1,162 +1,286 @@
+import os
+
 import streamlit as st
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+
+from aggregate_service import aggregate_backend
+from dashboard_timing import finish_rerun, render_timing_panel, span, start_rerun
+from data_validation import SCHEMAS
+from insurance_aggregates import AggregateMemo, aggregates_in_units, compute_aggregates, normalize_filters
+from insurance_dataset import Dataset, DatasetView
+from lazy_modules import lazy_import
+
+# Chart backends are imported on first use, so they do not slow down process start
+plt = lazy_import('matplotlib.pyplot')
 
 # Set page title and layout
 st.set_page_config(page_title="Insurance Data Dashboard", layout="wide")
 
-# Load the dataset using the new Streamlit caching mechanism
-@st.cache_data  # Cache data for performance (Streamlit updated method)
-def load_data():
-    # Load the CSV files for all years into one DataFrame
-    all_files = ['insurance_data_v2_2020.csv', 'insurance_data_v2_2021.csv', 'insurance_data_v2_2022.csv']
-    df = pd.concat((pd.read_csv(file) for file in all_files), ignore_index=True)
-    return df
+# CSV files for all years (a new or corrected file is ingested into the dataset on the next rerun)
+all_files = ['insurance_data_v2_2020.csv', 'insurance_data_v2_2021.csv', 'insurance_data_v2_2022.csv']
+
+# Append-only dataset of the year files (see insurance_dataset.py); its manifest decides what the dashboard shows
+DATASET_DIR = os.path.join('datasets', 'insurance_v2')
+
+
+# The dataset and its in-memory rows are shared by every session, so each segment is read once per process
+@st.cache_resource
+def get_dataset_view():
+    return DatasetView(Dataset(DATASET_DIR, SCHEMAS['insurance_v2']))
+
+
+# Validation report and quarantined rows of every ingested file (cached per dataset version)
+@st.cache_data
+def load_validation(version):
+    dataset = get_dataset_view().dataset
+    dataset.refresh()  # With the service, the manifest changes without this process ingesting
+    return dataset.validation()
+
 
-# Load data
-df = load_data()
+# Memo of computed aggregates per filter combination, shared across all sessions
+@st.cache_resource
+def get_aggregate_memo():
+    return AggregateMemo(max_entries=64, max_bytes=64 * 1024 * 1024)
+
+
+# Aggregates backend of this session: the aggregate service when $AGGREGATE_SERVICE is set and reachable
+# (see aggregate_service.py), otherwise the shared in-process dataset view and memo
+def get_backend():
+    if 'aggregate_backend' not in st.session_state:
+        st.session_state.aggregate_backend = aggregate_backend('insurance_v2', get_dataset_view(), get_aggregate_memo())
+    return st.session_state.aggregate_backend
+
+
+# Function to pick up the dataset's current version; when the service stops answering, the session
+# chooses its backend again (falling back to in-process answers)
+def refresh_backend():
+    try:
+        return get_backend(), get_backend().refresh()
+    except (ConnectionError, OSError):
+        del st.session_state.aggregate_backend
+        return get_backend(), get_backend().refresh()
+
+
+# Load the dataset: ingest only new or changed year files (validated in one pass), then pick up the new version.
+# With the aggregate service, the service ingests the files and this process only reads
+def load_data():
+    backend, version = refresh_backend()
+    if not backend.remote and get_dataset_view().dataset.ingest(all_files):
+        version = backend.refresh()
+    quarantined, report = load_validation(version)
+    return backend, quarantined, report
+
+
+# Function to load the year files progressively, rendering charts as each year arrives
+def load_data_progressive():
+    view = get_dataset_view()
+    progress = st.progress(0.0, text="Loading year files...")
+    preview = st.empty()
+    # Only new or changed files are read; the others are already segments of the dataset
+    pending = view.dataset.pending(all_files)
+
+    # Function to render the charts for the years loaded so far, as each file's segment is appended
+    def render_partial(entry):
+        for _, partial_df in view.iter_updates():
+            everything = normalize_filters(partial_df['year'].unique(), partial_df['insured_type'].unique(), (float('-inf'), float('inf')))
+            partial = aggregates_in_units(compute_aggregates(partial_df, everything), view.dataset.money)
+            with preview.container():
+                st.write(f"Partial Data (Rows: {partial['row_count']}, Years: {sorted(partial_df['year'].unique().tolist())})")
+                render_key_metrics(partial)
+                render_profit_loss_by_type(partial)
+        loaded = pending.index(entry['file']) + 1
+        progress.progress(loaded / len(pending), text=f"Loaded {entry['file']} ({loaded}/{len(pending)})")
+
+    # Every pending file is read concurrently; segments are appended (and rendered) in file order
+    view.dataset.ingest(pending, on_append=render_partial)
+
+    # Clear the partial results once every year has been loaded
+    progress.empty()
+    preview.empty()
+    return load_data()
+
+
+# Function to show the validation report and the quarantined rows
+def render_validation(quarantined, report):
+    label = f"Data Validation ({report.rows_quarantined} of {report.rows_checked} rows quarantined)"
+    with st.expander(label, expanded=False):
+        if report.rows_quarantined == 0:
+            st.write("All rows passed the checks.")
+            return
+        st.dataframe(report.summary())
+        st.write("Quarantined rows (first 100):")
+        st.dataframe(quarantined.head(100))
+
+
+# Function to plot the key metric pie charts from the aggregates of the filtered data
+def render_key_metrics(aggregates):
+    # --- Key Metrics ---
+    total_insured = max(0, aggregates['total_insured'])  # Ensure no negative values
+    total_profit = max(0, aggregates['total_profit'])  # Ensure no negative values
+
+    # Total loss is the sum of the negative profits, shown as a positive amount
+    total_loss = max(0, -aggregates['total_loss'])
+    total_insured_profit = max(0, aggregates['total_insured_profit'])  # Ensure no negative values
+
+    # --- Pie Chart Visualization ---
+    st.subheader("Key Metrics (Pie Charts)")
+
+    # Create a 2-column layout to display the charts side by side
+    col1, col2 = st.columns(2)
+
+    # Plot Pie Chart for Total Insured
+    with col1:
+        st.write("### Total Insured")
+        with span('figure'):
+            fig, ax = plt.subplots()
+            ax.pie([total_insured, 1], labels=["Total Insured", "Other"], autopct='%1.1f%%', startangle=90, colors=["#ff7f0e", "#f0f0f0"])
+            ax.set_title("Total Insured")
+        with span('serialize'):
+            st.pyplot(fig)
+        plt.close(fig)
+
+    # Plot Pie Chart for Total Profit
+    with col2:
+        st.write("### Total Profit")
+        with span('figure'):
+            fig, ax = plt.subplots()
+            ax.pie([total_profit, 1], labels=["Total Profit", "Other"], autopct='%1.1f%%', startangle=90, colors=["#2ca02c", "#f0f0f0"])
+            ax.set_title("Total Profit")
+        with span('serialize'):
+            st.pyplot(fig)
+        plt.close(fig)
+
+    # --- Additional Pie Charts for Profit and Loss ---
+    # Pie Chart for Total Insured Profit
+    with col1:
+        st.write("### Total Insured Profit")
+        with span('figure'):
+            fig, ax = plt.subplots()
+            ax.pie([total_insured_profit, 1], labels=["Total Insured Profit", "Other"], autopct='%1.1f%%', startangle=90, colors=["#2ca02c", "#f0f0f0"])
+            ax.set_title("Total Insured Profit")
+        with span('serialize'):
+            st.pyplot(fig)
+        plt.close(fig)
+
+    # Pie Chart for Total Loss
+    with col2:
+        st.write("### Total Loss")
+        with span('figure'):
+            fig, ax = plt.subplots()
+            ax.pie([total_loss, 1], labels=["Total Loss", "Other"], autopct='%1.1f%%', startangle=90, colors=["#d62728", "#f0f0f0"])
+            ax.set_title("Total Loss")
+        with span('serialize'):
+            st.pyplot(fig)
+        plt.close(fig)
+
+
+# Function to plot the profit and loss grouped bar chart from the aggregates of the filtered data
+def render_profit_loss_by_type(aggregates):
+    # --- Profit and Loss Grouped Bar Chart ---
+    st.subheader("Profit and Loss by Insured Type (Grouped Bar Chart)")
+
+    # Total profit and loss by insured type (computed with the other aggregates)
+    profit_loss_by_type = aggregates['profit_loss_by_type']
+
+    with span('figure'):
+        # Define width for each bar
+        bar_width = 0.35
+
+        # Define position for each bar group
+        r1 = range(len(profit_loss_by_type))  # Positions for profit bars
+        r2 = [x + bar_width for x in r1]     # Positions for loss bars (offset)
+
+        fig, ax = plt.subplots(figsize=(10, 6))
+
+        # Plot the profit and loss bars side-by-side
+        ax.bar(r1, profit_loss_by_type['Profit'], color='#2ca02c', width=bar_width, edgecolor='grey', label='Profit')
+        ax.bar(r2, profit_loss_by_type['Loss'], color='#d62728', width=bar_width, edgecolor='grey', label='Loss')
+
+        # Add x-ticks in the middle of the two bars
+        ax.set_xticks([r + bar_width / 2 for r in r1])
+        ax.set_xticklabels(profit_loss_by_type.index)
+
+        # Set chart title and labels
+        ax.set_title("Profit and Loss by Insured Type")
+        ax.set_ylabel("Amount")
+        ax.set_xlabel("Insured Type")
+
+        # Add value labels on bars
+        for i in range(len(profit_loss_by_type)):
+            ax.annotate(f'${profit_loss_by_type["Profit"].iloc[i]:,.2f}',
+                        xy=(r1[i], profit_loss_by_type["Profit"].iloc[i]),
+                        xytext=(0, 5),  # 5 points vertical offset
+                        textcoords='offset points',
+                        ha='center', va='bottom', color='black')
+            ax.annotate(f'${profit_loss_by_type["Loss"].iloc[i]:,.2f}',
+                        xy=(r2[i], profit_loss_by_type["Loss"].iloc[i]),
+                        xytext=(0, 5),  # 5 points vertical offset
+                        textcoords='offset points',
+                        ha='center', va='bottom', color='black')
+
+    # Show the plot
+    with span('serialize'):
+        st.pyplot(fig)
+    plt.close(fig)
+
+
+# Time each stage of this rerun
+start_rerun('insurance_dashboard')
 
 # Show basic information about the dataset
 st.title("Insurance Data Dashboard")
 st.write("This is the interactive dashboard for visualizing and filtering the insurance data.")
-st.write(f"Total Rows: {df.shape[0]}")
+
+# Progressive mode shows charts for each year as soon as its file is loaded
+progressive = st.sidebar.checkbox('Progressive loading', value=True)
+
+# Load data (after the first load, a rerun only reads files and segments that are new since the last one).
+# With the aggregate service the rows live in its workers, so there is nothing to render progressively here
+with span('load'):
+    if progressive and 'loaded' not in st.session_state and not get_backend().remote:
+        backend, quarantined, report = load_data_progressive()
+        st.session_state.loaded = True
+    else:
+        backend, quarantined, report = load_data()
+    # Row count and filter options of the current version
+    summary = backend.describe()
+
+if backend.warning:
+    st.warning(backend.warning)
+st.write(f"Total Rows: {summary['row_count']}")
+render_validation(quarantined, report)
 
 # Filtering options in the sidebar
 st.sidebar.header("Filter Data")
 
 # Filter by Year (with search and multi-select)
-years = df['year'].unique().tolist()
+years = summary['years']
 year_filter = st.sidebar.multiselect('Select Year(s):', years, default=years)
 
 # Filter by Insured Type (with search and multi-select)
-insured_types = df['insured_type'].unique().tolist()
+insured_types = summary['insured_types']
 insured_type_filter = st.sidebar.multiselect('Select Insured Type(s):', insured_types, default=insured_types)
 
 # Filter by Loss Ratio Range (using a slider for range selection)
-loss_ratio_min, loss_ratio_max = float(df['loss_ratio'].min()), float(df['loss_ratio'].max())
+loss_ratio_min, loss_ratio_max = summary['loss_ratio_range']
 loss_ratio_filter = st.sidebar.slider('Select Loss Ratio Range:', loss_ratio_min, loss_ratio_max, (loss_ratio_min, loss_ratio_max))
 
-# Apply filters to the DataFrame
-filtered_df = df[
-    (df['year'].isin(year_filter)) &
-    (df['insured_type'].isin(insured_type_filter)) &
-    (df['loss_ratio'] >= loss_ratio_filter[0]) &
-    (df['loss_ratio'] <= loss_ratio_filter[1])
-]
+# Apply filters and compute the aggregates, reusing them when this filter combination was seen before
+# (money is converted to currency units only here, for display)
+filters = normalize_filters(year_filter, insured_type_filter, loss_ratio_filter)
+aggregates = aggregates_in_units(backend.aggregates(filters), summary['money'])
 
 # Display filtered data
-st.write(f"Filtered Data (Rows: {filtered_df.shape[0]})")
+st.write(f"Filtered Data (Rows: {aggregates['row_count']})")
 
 # Show the filtered DataFrame (Optional)
-st.dataframe(filtered_df.head())
-
-# --- Calculating Key Metrics ---
-total_insured = max(0, filtered_df['insured'].sum())  # Ensure no negative values
-total_profit = max(0, filtered_df['profit'].sum())  # Ensure no negative values
-
-# Calculate total loss, making sure to take absolute value for loss profits
-total_loss = max(0, filtered_df[filtered_df['profit'] < 0]['profit'].abs().sum())  # Apply abs() before summing
-total_insured_profit = max(0, filtered_df[filtered_df['profit'] > 0]['profit'].sum())  # Ensure no negative values
-
-# Pie Chart Data
-metrics = {
-    "Total Insured": total_insured,
-    "Total Profit": total_profit,
-    "Total Loss": total_loss,
-    "Total Insured Profit": total_insured_profit
-}
-
-# --- Pie Chart Visualization ---
-st.subheader("Key Metrics (Pie Charts)")
-
-# Create a 2-column layout to display the charts side by side
-col1, col2 = st.columns(2)
-
-# Plot Pie Chart for Total Insured
-with col1:
-    st.write("### Total Insured")
-    fig, ax = plt.subplots()
-    ax.pie([total_insured, 1], labels=["Total Insured", "Other"], autopct='%1.1f%%', startangle=90, colors=["#ff7f0e", "#f0f0f0"])
-    ax.set_title("Total Insured")
-    st.pyplot(fig)
-
-# Plot Pie Chart for Total Profit
-with col2:
-    st.write("### Total Profit")
-    fig, ax = plt.subplots()
-    ax.pie([total_profit, 1], labels=["Total Profit", "Other"], autopct='%1.1f%%', startangle=90, colors=["#2ca02c", "#f0f0f0"])
-    ax.set_title("Total Profit")
-    st.pyplot(fig)
-
-# --- Additional Pie Charts for Profit and Loss ---
-# Pie Chart for Total Insured Profit
-with col1:
-    st.write("### Total Insured Profit")
-    fig, ax = plt.subplots()
-    ax.pie([total_insured_profit, 1], labels=["Total Insured Profit", "Other"], autopct='%1.1f%%', startangle=90, colors=["#2ca02c", "#f0f0f0"])
-    ax.set_title("Total Insured Profit")
-    st.pyplot(fig)
-
-# Pie Chart for Total Loss
-with col2:
-    st.write("### Total Loss")
-    fig, ax = plt.subplots()
-    ax.pie([total_loss, 1], labels=["Total Loss", "Other"], autopct='%1.1f%%', startangle=90, colors=["#d62728", "#f0f0f0"])
-    ax.set_title("Total Loss")
-    st.pyplot(fig)
-
-# --- Profit and Loss Grouped Bar Chart ---
-st.subheader("Profit and Loss by Insured Type (Grouped Bar Chart)")
-
-# Separate profit and loss data
-profit_data = filtered_df[filtered_df['profit'] > 0]
-loss_data = filtered_df[filtered_df['profit'] < 0]
-
-# Calculate total profit and loss by insured type, applying abs() before groupby for losses
-profit_by_type = profit_data.groupby('insured_type')['profit'].sum()
-loss_by_type = loss_data.groupby('insured_type')['profit'].apply(lambda x: x.abs().sum())  # Apply abs() here before groupby
-
-# Combine profit and loss data into one DataFrame
-profit_loss_by_type = pd.DataFrame({
-    'Profit': profit_by_type,
-    'Loss': loss_by_type
-}).fillna(0)  # Fill NaN with 0 for types without profit or loss
-
-# Define width for each bar
-bar_width = 0.35
-
-# Define position for each bar group
-r1 = range(len(profit_loss_by_type))  # Positions for profit bars
-r2 = [x + bar_width for x in r1]     # Positions for loss bars (offset)
-
-fig, ax = plt.subplots(figsize=(10, 6))
-
-# Plot the profit and loss bars side-by-side
-ax.bar(r1, profit_loss_by_type['Profit'], color='#2ca02c', width=bar_width, edgecolor='grey', label='Profit')
-ax.bar(r2, profit_loss_by_type['Loss'], color='#d62728', width=bar_width, edgecolor='grey', label='Loss')
-
-# Add x-ticks in the middle of the two bars
-ax.set_xticks([r + bar_width / 2 for r in r1])
-ax.set_xticklabels(profit_loss_by_type.index)
-
-# Set chart title and labels
-ax.set_title("Profit and Loss by Insured Type")
-ax.set_ylabel("Amount")
-ax.set_xlabel("Insured Type")
-
-# Add value labels on bars
-for i in range(len(profit_loss_by_type)):
-    ax.annotate(f'${profit_loss_by_type["Profit"].iloc[i]:,.2f}',
-                xy=(r1[i], profit_loss_by_type["Profit"].iloc[i]),
-                xytext=(0, 5),  # 5 points vertical offset
-                textcoords='offset points',
-                ha='center', va='bottom', color='black')
-    ax.annotate(f'${profit_loss_by_type["Loss"].iloc[i]:,.2f}',
-                xy=(r2[i], profit_loss_by_type["Loss"].iloc[i]),
-                xytext=(0, 5),  # 5 points vertical offset
-                textcoords='offset points',
-                ha='center', va='bottom', color='black')
-
-# Show the plot
-st.pyplot(fig)
+st.dataframe(aggregates['preview'])
+
+# Plot the key metrics and the profit/loss chart for the filtered data
+render_key_metrics(aggregates)
+render_profit_loss_by_type(aggregates)
+
+# Show where this rerun spent its time (the timings are also appended to $DASHBOARD_TIMING_LOG when set)
+if st.sidebar.checkbox('Show timing panel', value=False):
+    render_timing_panel(st.sidebar)
+else:
+    finish_rerun()
@@ -1,66 +1,147 @@
+import os
+
 import streamlit as st
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+
+from aggregate_service import aggregate_backend
+from dashboard_timing import finish_rerun, render_timing_panel, span, start_rerun
+from data_validation import SCHEMAS
+from insurance_aggregates import AggregateMemo, aggregates_in_units, normalize_filters, percentile_table, sketch_histogram
+from insurance_charts import plot_profit_loss_by_type, plot_yearly_gwp, plot_yearly_loss_ratio
+from insurance_dataset import Dataset, DatasetView
+from insurance_query import describe_intent, parse_query
+from lazy_modules import lazy_import
+from money import MONEY_COLUMNS, from_cents
+
+# Chart backends are imported on first use, so they do not slow down process start
+plt = lazy_import('matplotlib.pyplot')
+sns = lazy_import('seaborn')
 
 # Set page title and layout
 st.set_page_config(page_title="Insurance Data Dashboard", layout="wide")
 
+# CSV files for all years (a new or corrected file is ingested into the dataset on the next rerun)
+all_files = ['insurance_data_xl2_2020.csv', 'insurance_data_xl2_2021.csv', 'insurance_data_xl2_2022.csv']
+
+# Append-only dataset of the year files (see insurance_dataset.py); its manifest decides what the dashboard shows
+DATASET_DIR = os.path.join('datasets', 'insurance_xl2')
+
+
+# The dataset and its in-memory rows are shared by every session, so each segment is read once per process
+@st.cache_resource
+def get_dataset_view():
+    return DatasetView(Dataset(DATASET_DIR, SCHEMAS['insurance_xl2']))
+
 
-# Load the dataset using Streamlit caching
+# Validation report and quarantined rows of every ingested file (cached per dataset version)
 @st.cache_data  # Streamlit's updated method for caching data
+def load_validation(version):
+    dataset = get_dataset_view().dataset
+    dataset.refresh()  # With the service, the manifest changes without this process ingesting
+    return dataset.validation()
+
+
+# Memo of computed aggregates per filter combination, shared across all sessions
+@st.cache_resource
+def get_aggregate_memo():
+    return AggregateMemo(max_entries=64, max_bytes=64 * 1024 * 1024)
+
+
+# Aggregates backend of this session: the aggregate service when $AGGREGATE_SERVICE is set and reachable
+# (see aggregate_service.py), otherwise the shared in-process dataset view and memo
+def get_backend():
+    if 'aggregate_backend' not in st.session_state:
+        st.session_state.aggregate_backend = aggregate_backend('insurance_xl2', get_dataset_view(), get_aggregate_memo())
+    return st.session_state.aggregate_backend
+
+
+# Function to pick up the dataset's current version; when the service stops answering, the session
+# chooses its backend again (falling back to in-process answers)
+def refresh_backend():
+    try:
+        return get_backend(), get_backend().refresh()
+    except (ConnectionError, OSError):
+        del st.session_state.aggregate_backend
+        return get_backend(), get_backend().refresh()
+
+
 def load_data():
-    # Load the CSV files for all years into one DataFrame
-    all_files = ['insurance_data_xl2_2020.csv', 'insurance_data_xl2_2021.csv', 'insurance_data_xl2_2022.csv']
-    df = pd.concat((pd.read_csv(file) for file in all_files), ignore_index=True)
+    # Ingest only new or changed year files. Validation runs in the same pass: loss_ratio "NN %" labels
+    # are parsed to floats, and bad rows are quarantined. Then pick up the dataset's new version.
+    # With the aggregate service, the service ingests the files and this process only reads
+    backend, version = refresh_backend()
+    if not backend.remote and get_dataset_view().dataset.ingest(all_files):
+        version = backend.refresh()
+    quarantined, report = load_validation(version)
+    return backend, quarantined, report
+
 
-    # Clean loss_ratio column if necessary (remove '%' and convert to float)
-    df['loss_ratio'] = df['loss_ratio'].str.replace('%', '').astype(float)
+# Quantile sketches of the dataset, merged from the ones stored at ingest once per version for every session
+@st.cache_resource(max_entries=2)
+def load_sketches(version):
+    return get_backend().sketches()
 
-    return df
 
+# Time each stage of this rerun
+start_rerun('insurance_dashboard_xl2')
 
 # Load data
-df = load_data()
+with span('load'):
+    backend, quarantined, report = load_data()
+    # Row count and filter options of the current version
+    summary = backend.describe()
+    # Quantile sketches of loss ratio and profit per (year, insured_type), shared by every session
+    partition_sketches = load_sketches(backend.version)
 
 # Show basic information about the dataset
 st.title("Insurance Data Dashboard")
 st.write("This is the interactive dashboard for visualizing and filtering the insurance data.")
-st.write(f"Total Rows: {df.shape[0]}")
+if backend.warning:
+    st.warning(backend.warning)
+st.write(f"Total Rows: {summary['row_count']}")
+with st.expander(f"Data Validation ({report.rows_quarantined} of {report.rows_checked} rows quarantined)"):
+    if report.rows_quarantined:
+        st.dataframe(report.summary())
+        st.dataframe(quarantined.head(100))
+    else:
+        st.write("All rows passed the checks.")
 
 # Filter options in the sidebar
 st.sidebar.header("Filter Data")
 
 # Filter by Year (with search and multi-select)
-years = df['year'].unique().tolist()
+years = summary['years']
 year_filter = st.sidebar.multiselect('Select Year(s):', years, default=years)
 
 # Filter by Insured Type (with search and multi-select)
-insured_types = df['insured_type'].unique().tolist()
+insured_types = summary['insured_types']
 insured_type_filter = st.sidebar.multiselect('Select Insured Type(s):', insured_types, default=insured_types)
 
 # Filter by Loss Ratio Range (using a slider for range selection)
-loss_ratio_min, loss_ratio_max = df['loss_ratio'].min(), df['loss_ratio'].max()
+loss_ratio_min, loss_ratio_max = summary['loss_ratio_range']
 loss_ratio_filter = st.sidebar.slider('Select Loss Ratio Range:', loss_ratio_min, loss_ratio_max,
                                       (loss_ratio_min, loss_ratio_max))
 
-# Apply filters to the DataFrame
-filtered_df = df[
-    (df['year'].isin(year_filter)) &
-    (df['insured_type'].isin(insured_type_filter)) &
-    (df['loss_ratio'] >= loss_ratio_filter[0]) &
-    (df['loss_ratio'] <= loss_ratio_filter[1])
-    ]
+# Apply filters and compute the aggregates, reusing them when this filter combination was seen before
+# (money is converted to currency units only here, for display)
+filters = normalize_filters(year_filter, insured_type_filter, loss_ratio_filter)
+money_in_cents = summary['money'] == 'cents'
+aggregates = aggregates_in_units(backend.aggregates(filters), summary['money'])
+
+# Show the aggregate cache metrics in the sidebar
+with st.sidebar.expander("Aggregate Cache"):
+    st.write(backend.stats())
 
 # Display filtered data
-st.write(f"Filtered Data (Rows: {filtered_df.shape[0]})")
-st.dataframe(filtered_df.head())
+st.write(f"Filtered Data (Rows: {aggregates['row_count']})")
+st.dataframe(aggregates['preview'])
 
 # --- Calculating Key Metrics ---
-total_insured = filtered_df['insured'].sum()  # Sum of insured
-total_profit = filtered_df['profit'].sum()  # Sum of profit
-total_loss = filtered_df[filtered_df['profit'] < 0]['profit'].sum()  # Total loss (negative profit)
-total_insured_profit = filtered_df[filtered_df['profit'] > 0]['profit'].sum()  # Total insured profit
+total_insured = aggregates['total_insured']  # Sum of insured
+total_profit = aggregates['total_profit']  # Sum of profit
+total_loss = aggregates['total_loss']  # Total loss (negative profit)
+total_insured_profit = aggregates['total_insured_profit']  # Total insured profit
 
 # Pie Chart Data
 metrics = {
@@ -76,37 +157,30 @@ st.subheader("Year-wise GWP and Loss Ratio")
 # Create a 2-column layout to display the charts side by side
 col1, col2 = st.columns(2)
 
-# Plot Pie Chart for 'GWP'
+# Plot Pie Chart for 'GWP' (the figures are shared with the report job, see insurance_charts.py)
 with col1:
     st.write("### Year-wise GWP")
-    yearly_gwp = filtered_df.groupby('year')['gwp'].sum()
-    fig, ax = plt.subplots()
-    ax.pie(yearly_gwp, labels=yearly_gwp.index, autopct='%1.1f%%', startangle=90,
-           colors=sns.color_palette("Set3", len(yearly_gwp)))
-    ax.set_title("Year-wise GWP")
-    st.pyplot(fig)
+    with span('figure'):
+        fig = plot_yearly_gwp(aggregates)
+    with span('serialize'):
+        st.pyplot(fig)
+    plt.close(fig)
 
 # Plot Pie Chart for 'Loss Ratio'
 with col2:
     st.write("### Year-wise Loss Ratio")
-    yearly_loss_ratio = filtered_df.groupby('year')['loss_ratio'].mean()
-
-    # Ensure loss_ratio is formatted correctly for the pie chart
-    yearly_loss_ratio = yearly_loss_ratio.round(1)  # Optional: round to 1 decimal place
-    yearly_loss_ratio_str = yearly_loss_ratio.astype(str) + " %"
-
-    fig, ax = plt.subplots()
-    ax.pie(yearly_loss_ratio, labels=yearly_loss_ratio_str.index, autopct='%1.1f%%', startangle=90,
-           colors=sns.color_palette("Set3", len(yearly_loss_ratio)))
-    ax.set_title("Year-wise Loss Ratio")
-    st.pyplot(fig)
+    with span('figure'):
+        fig = plot_yearly_loss_ratio(aggregates)
+    with span('serialize'):
+        st.pyplot(fig)
+    plt.close(fig)
 
 # --- Table for Total GWP and Loss Ratio ---
 st.subheader("Total GWP and Loss Ratio")
 
 # Calculate total GWP and average loss ratio based on the selected filters
-total_gwp = filtered_df['gwp'].sum()
-average_loss_ratio = filtered_df['loss_ratio'].mean()
+total_gwp = aggregates['total_gwp']
+average_loss_ratio = aggregates['average_loss_ratio']
 
 # Create a DataFrame for displaying the results
 table_data = {
@@ -123,10 +197,7 @@ st.table(table_df)
 st.subheader("Total GWP and Loss Ratio by Year")
 
 # Calculate total GWP and average loss ratio for each year
-yearly_summary = filtered_df.groupby('year').agg(
-    total_gwp=('gwp', 'sum'),
-    average_loss_ratio=('loss_ratio', 'mean')
-).reset_index()
+yearly_summary = aggregates['yearly_summary'].copy()
 
 # Format the average loss ratio to 2 decimal places and append "%" symbol
 yearly_summary['average_loss_ratio'] = yearly_summary['average_loss_ratio'].round(2).astype(str) + " %"
@@ -134,61 +205,55 @@ yearly_summary['average_loss_ratio'] = yearly_summary['average_loss_ratio'].roun
 # Display the table for year-wise GWP and loss ratio
 st.table(yearly_summary)
 
+# --- Percentile Tables and Histograms from the Quantile Sketches ---
+st.subheader("Loss Ratio and Profit Percentiles")
+st.caption("Estimated from per-year, per-insured-type sketches (within 1%), merged for the selected years and "
+           "insured types. The loss ratio range filter is not applied here.")
+
+with span('groupby'):
+    loss_ratio_percentiles = percentile_table(partition_sketches, 'loss_ratio', filters[0], filters[1], by='year')
+    profit_percentiles = percentile_table(partition_sketches, 'profit', filters[0], filters[1], by='insured_type')
+    if money_in_cents:
+        profit_percentiles = from_cents(profit_percentiles)
+
+col3, col4 = st.columns(2)
+
+with col3:
+    st.write("### Loss Ratio Percentiles by Year")
+    st.table(loss_ratio_percentiles.round(2).astype(str) + " %")
+
+with col4:
+    st.write("### Profit Percentiles by Insured Type")
+    st.table(profit_percentiles.map(lambda value: f"${value:,.0f}"))
+
+# Histogram of the selected metric, rebinned from the sketch buckets
+histogram_metric = st.selectbox("Distribution of:", ['loss_ratio', 'profit'],
+                                format_func=lambda metric: metric.replace('_', ' ').title())
+with span('groupby'):
+    histogram_counts, histogram_edges = sketch_histogram(partition_sketches, histogram_metric, filters[0], filters[1])
+    if money_in_cents and histogram_metric in MONEY_COLUMNS:
+        histogram_edges = from_cents(histogram_edges)
+if len(histogram_counts):
+    with span('figure'):
+        fig, ax = plt.subplots(figsize=(10, 4))
+        ax.bar(histogram_edges[:-1], histogram_counts, width=np.diff(histogram_edges), align='edge', edgecolor='grey')
+        ax.set_title(f"Distribution of {histogram_metric.replace('_', ' ').title()}")
+        ax.set_ylabel("Policies")
+    with span('serialize'):
+        st.pyplot(fig)
+    plt.close(fig)
+
 # --- Profit and Loss Grouped Bar Chart ---
 st.subheader("Profit and Loss by Insured Type (Grouped Bar Chart)")
 
-# Separate profit and loss data
-profit_data = filtered_df[filtered_df['profit'] > 0]
-loss_data = filtered_df[filtered_df['profit'] < 0]
-
-# Calculate total profit and loss by insured type, applying abs() before groupby for losses
-profit_by_type = profit_data.groupby('insured_type')['profit'].sum()
-loss_by_type = loss_data.groupby('insured_type')['profit'].apply(
-    lambda x: x.abs().sum())  # Apply abs() here before groupby
-
-# Combine profit and loss data into one DataFrame
-profit_loss_by_type = pd.DataFrame({
-    'Profit': profit_by_type,
-    'Loss': loss_by_type
-}).fillna(0)  # Fill NaN with 0 for types without profit or loss
-
-# Define width for each bar
-bar_width = 0.35
-
-# Define position for each bar group
-r1 = range(len(profit_loss_by_type))  # Positions for profit bars
-r2 = [x + bar_width for x in r1]  # Positions for loss bars (offset)
-
-fig, ax = plt.subplots(figsize=(10, 6))
-
-# Plot the profit and loss bars side-by-side
-ax.bar(r1, profit_loss_by_type['Profit'], color='#2ca02c', width=bar_width, edgecolor='grey', label='Profit')
-ax.bar(r2, profit_loss_by_type['Loss'], color='#d62728', width=bar_width, edgecolor='grey', label='Loss')
-
-# Add x-ticks in the middle of the two bars
-ax.set_xticks([r + bar_width / 2 for r in r1])
-ax.set_xticklabels(profit_loss_by_type.index)
-
-# Set chart title and labels
-ax.set_title("Profit and Loss by Insured Type")
-ax.set_ylabel("Amount")
-ax.set_xlabel("Insured Type")
-
-# Add value labels on bars
-for i in range(len(profit_loss_by_type)):
-    ax.annotate(f'${profit_loss_by_type["Profit"].iloc[i]:,.2f}',
-                xy=(r1[i], profit_loss_by_type["Profit"].iloc[i]),
-                xytext=(0, 5),  # 5 points vertical offset
-                textcoords='offset points',
-                ha='center', va='bottom', color='black')
-    ax.annotate(f'${profit_loss_by_type["Loss"].iloc[i]:,.2f}',
-                xy=(r2[i], profit_loss_by_type["Loss"].iloc[i]),
-                xytext=(0, 5),  # 5 points vertical offset
-                textcoords='offset points',
-                ha='center', va='bottom', color='black')
+# Total profit and loss by insured type (computed with the other aggregates)
+with span('figure'):
+    fig = plot_profit_loss_by_type(aggregates)
 
 # Show the plot
-st.pyplot(fig)
+with span('serialize'):
+    st.pyplot(fig)
+plt.close(fig)
 
 # --- Adding a Text Box for User Query ---
 st.subheader("Ask a Question")
@@ -196,13 +261,47 @@ st.subheader("Ask a Question")
 # Text box for the user to type their query
 user_query = st.text_input("Enter your question (e.g., 'total gwp year wise in pie chart'): ")
 
-# Handling the query for "total gwp year wise in pie chart"
-if user_query and 'total gwp year wise in pie chart' in user_query.lower():
-    st.write("### Total GWP Year-wise (Pie Chart)")
-
-    # Plot Pie Chart for 'GWP'
-    yearly_gwp = filtered_df.groupby('year')['gwp'].sum()
-    fig, ax = plt.subplots()
-    ax.pie(yearly_gwp, labels=yearly_gwp.index, autopct='%1.1f%%', startangle=90, colors=sns.color_palette("Set3", len(yearly_gwp)))
-    ax.set_title("Year-wise GWP")
-    st.pyplot(fig)
+# Parse the question into an intent (metric, group-by, chart, filters) and answer it from the aggregate memo
+if user_query:
+    intent = parse_query(user_query, insured_types)
+    if intent is None:
+        st.write("Sorry, I could not find a metric in the question. Try e.g. 'average loss ratio by insured type in bar chart'.")
+    else:
+        title = describe_intent(intent)
+        with span('query'):
+            result = backend.query(filters, intent)
+            if money_in_cents and intent.metric in MONEY_COLUMNS and intent.aggregation != 'count':
+                result = from_cents(result)
+        chart = intent.chart
+        if chart == 'pie' and intent.group_by is not None and (result < 0).any():
+            chart = 'bar'  # A pie chart cannot show negative values
+        st.write(f"### {title}" if chart == 'table' else f"### {title} ({chart.title()} Chart)")
+
+        if (result.empty if intent.group_by is not None else pd.isna(result)):
+            st.info("No rows match the question and the sidebar filters.")
+        elif chart == 'pie' and intent.group_by is not None and not (result > 0).any():
+            st.info("Every value is zero, so there is nothing to show in a pie chart.")
+        elif intent.group_by is None:
+            # A single value is shown as a one-row table
+            st.table(pd.DataFrame({"Metric": [title], "Value": [f"{result:,.2f}"]}))
+        elif chart == 'table':
+            st.table(result.reset_index())
+        else:
+            with span('figure'):
+                fig, ax = plt.subplots()
+                if chart == 'pie':
+                    ax.pie(result, labels=result.index, autopct='%1.1f%%', startangle=90, colors=sns.color_palette("Set3", len(result)))
+                elif chart == 'line':
+                    ax.plot(result.index.astype(str), result.values, marker='o')
+                else:
+                    ax.bar(result.index.astype(str), result.values, color=sns.color_palette("Set3", len(result)))
+                ax.set_title(title)
+            with span('serialize'):
+                st.pyplot(fig)
+            plt.close(fig)
+
+# Show where this rerun spent its time (the timings are also appended to $DASHBOARD_TIMING_LOG when set)
+if st.sidebar.checkbox('Show timing panel', value=False):
+    render_timing_panel(st.sidebar)
+else:
+    finish_rerun()
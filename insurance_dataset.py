@@ -0,0 +1,365 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows locks files with msvcrt instead
+    fcntl = None
+    import msvcrt
+
+import pandas as pd
+import pyarrow as pa
+
+from data_validation import SCHEMAS, ValidationReport
+from insurance_aggregates import (build_partition_sketches, load_partition_sketches, merge_partition_sketches,
+                                  merge_partitions, partition_aggregates, save_partition_sketches)
+from insurance_loader import read_validated_file
+from money import DEFAULT_MONEY, MONEY_UNITS
+
+# Name of the manifest file inside a dataset directory, and of the lock file that serializes writers
+MANIFEST_FILE = 'manifest.json'
+LOCK_FILE = 'ingest.lock'
+
+
+# Function to fingerprint a source file cheaply (size and modification time, like make)
+def file_fingerprint(file):
+    stat = os.stat(file)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+# Context manager holding an exclusive lock on a file, across processes (blocks until the lock is free)
+@contextmanager
+def file_lock(path):
+    with open(path, 'a+b') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)  # Gives up after about 10 s
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# Append-only dataset: every ingested file becomes an immutable Parquet segment, and the manifest lists
+# the segments (in ingestion order) with each one's per-partition aggregates and validation counts.
+# The manifest is the source of truth for what the dashboards see; ingesting only ever appends to it.
+#
+#   <root>/manifest.json
+#   <root>/ingest.lock                 held by the process that is ingesting (dashboards, service, jobs, CLI)
+#   <root>/segments/000001.parquet     valid rows of the first ingested file
+#   <root>/quarantine/000001.parquet   rows of that file that failed validation (if any)
+#   <root>/sketches/000001.npz         quantile sketches of that file's rows per partition
+#   <root>/snapshots/000007.arrow      visible rows at version 7 as uncompressed Arrow IPC, for memory-mapped readers
+#
+# Money columns are stored as float64 units or as int64 cents (`money`), fixed when the dataset is created;
+# in cents the partition aggregates are exact integers too, so merging them in any order gives the same totals
+class Dataset:
+    def __init__(self, root, schema, key=('year', 'sl'), money=None):
+        self.root = root
+        self.schema = schema
+        self.key = list(key)  # A row in a later segment replaces the row with the same key in earlier segments
+        # One dataset object is shared by every dashboard session; re-entrant so an ingest callback can refresh views
+        self._lock = threading.RLock()
+        self._new_money = money or DEFAULT_MONEY
+        self.manifest = self._read_manifest()
+        if money and money != self.money:
+            raise ValueError(f"{root} stores money in {self.money}, not {money}; ingest into a new dataset directory")
+        self.schema = schema._replace(money=self.money)
+
+    @property
+    def entries(self):
+        return self.manifest['entries']
+
+    # How the rows and partition aggregates hold money: 'units' or 'cents' (see money.py)
+    @property
+    def money(self):
+        return self.manifest['money']
+
+    # Version of the dataset: the number of ingested segments (changes whenever something is ingested)
+    @property
+    def version(self):
+        return len(self.entries)
+
+    def _path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def _read_manifest(self):
+        try:
+            with open(self._path(MANIFEST_FILE)) as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            return {'schema': self.schema.name, 'key': self.key, 'money': self._new_money, 'entries': []}
+
+    # Function to write the manifest atomically, so readers never see a half-written file
+    def _write_manifest(self):
+        os.makedirs(self.root, exist_ok=True)
+        temporary = self._path(MANIFEST_FILE + '.tmp')
+        with open(temporary, 'w') as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=1)
+        os.replace(temporary, self._path(MANIFEST_FILE))
+
+    # Function to re-read the manifest (e.g. after another process ingested files); returns True when it changed
+    def refresh(self):
+        with self._lock:
+            manifest = self._read_manifest()
+            changed = len(manifest['entries']) != self.version
+            self.manifest = manifest
+            return changed
+
+    # Function to list the files that are new or changed since they were last ingested. A file that is gone
+    # (e.g. archived) but already ingested is skipped: the manifest and its segments still hold the rows
+    def pending(self, files):
+        latest = {}
+        for entry in self.entries:
+            latest[entry['file']] = entry['fingerprint']
+        pending = []
+        for file in files:
+            try:
+                fingerprint = file_fingerprint(file)
+            except FileNotFoundError:
+                if file in latest:
+                    continue
+                raise
+            if latest.get(file) != fingerprint:
+                pending.append(file)
+        return pending
+
+    # Function to ingest files that are new or changed; unchanged files are skipped without being read.
+    # A changed file (or any file passed with correction=True) replaces the earlier rows that share its keys.
+    # `on_append(entry)` is called as each file's segment is recorded. Returns the manifest entries that were added
+    def ingest(self, files, correction=False, on_append=None):
+        # Unchanged files are skipped without taking the lock, so reruns do not queue behind a writer
+        with self._lock:
+            self.manifest = self._read_manifest()
+            if not self.pending(files):
+                return []
+        os.makedirs(self.root, exist_ok=True)
+        # One writer at a time across processes: entry ids come from the manifest, so it is re-read under the lock
+        with self._lock, file_lock(self._path(LOCK_FILE)):
+            self.manifest = self._read_manifest()
+            pending = self.pending(files)
+            if not pending:
+                return []
+
+            # Files are read and validated concurrently, then appended in the given order
+            fingerprints = [file_fingerprint(file) for file in pending]
+            with ThreadPoolExecutor(max_workers=min(len(pending), os.cpu_count() or 1)) as executor:
+                results = executor.map(read_validated_file, pending, [self.schema] * len(pending))
+                added = []
+                for file, fingerprint, result in zip(pending, fingerprints, results):
+                    ingested = any(entry['file'] == file for entry in self.entries)
+                    added.append(self._append(file, fingerprint, result, correction or ingested))
+                    if on_append is not None:
+                        on_append(added[-1])
+        return added
+
+    # Function to store one validated file as a new segment and record it in the manifest
+    def _append(self, file, fingerprint, result, correction):
+        start = time.perf_counter()
+        df, quarantined, report = result
+
+        entry_id = self.version + 1
+        segment = os.path.join('segments', f'{entry_id:06d}.parquet')
+        os.makedirs(self._path('segments'), exist_ok=True)
+        df.to_parquet(self._path(segment), index=False)
+        quarantine = None
+        if not quarantined.empty:
+            quarantine = os.path.join('quarantine', f'{entry_id:06d}.parquet')
+            os.makedirs(self._path('quarantine'), exist_ok=True)
+            quarantined.astype(str).to_parquet(self._path(quarantine), index=False)
+
+        # Only this file's rows are aggregated and sketched; a correction also subtracts the rows it replaces
+        parts = partition_aggregates(df)
+        sketches = build_partition_sketches(df)
+        replaced = self._visible_rows_for(df[self.key]) if correction else df.iloc[:0]
+        if not replaced.empty:
+            parts = merge_partitions([parts, partition_aggregates(replaced)], signs=[1, -1])
+            sketches = merge_partition_sketches([sketches, build_partition_sketches(replaced)], signs=[1, -1])
+        sketch_file = os.path.join('sketches', f'{entry_id:06d}.npz')
+        os.makedirs(self._path('sketches'), exist_ok=True)
+        save_partition_sketches(self._path(sketch_file), sketches)
+
+        entry = {
+            'id': entry_id,
+            'file': file,
+            'fingerprint': fingerprint,
+            'kind': 'correction' if correction else 'append',
+            'segment': segment,
+            'quarantine': quarantine,
+            'rows': len(df),
+            'rows_replaced': len(replaced),
+            'rows_checked': report.rows_checked,
+            'rows_quarantined': report.rows_quarantined,
+            'violations': [[column, check, rows] for (_, column, check), rows in report.counts.items()],
+            'years': sorted(int(year) for year in df['year'].unique()),
+            'partitions': parts.to_dict('records'),
+            'sketches': sketch_file,
+            'ingested_at': pd.Timestamp.now().isoformat(timespec='seconds'),
+            'ingest_seconds': round(time.perf_counter() - start, 3),
+        }
+        self.entries.append(entry)
+        self._write_manifest()
+        return entry
+
+    # Function to find the currently visible rows with the given keys, reading only the segments of their years
+    def _visible_rows_for(self, keys):
+        years = set(int(year) for year in keys['year'].unique())
+        # Only the key and the aggregated columns are read
+        columns = list(dict.fromkeys(self.key + ['insured_type', 'insured', 'profit', 'gwp', 'loss_ratio']))
+        frames = []
+        for entry in self.entries:
+            if years.intersection(entry['years']):
+                segment = pd.read_parquet(self._path(entry['segment']), columns=columns)
+                frames.append(segment.merge(keys, on=self.key, how='inner'))
+        if not frames:
+            return keys.iloc[:0]
+        # The last segment holding a key has its visible row
+        return pd.concat(frames, ignore_index=True).drop_duplicates(self.key, keep='last')
+
+    # Function to return the per-(year, insured_type) aggregates of the visible rows, merged from the manifest
+    def partitions(self):
+        parts = [pd.DataFrame(entry['partitions']) for entry in self.entries if entry['partitions']]
+        return merge_partitions(parts, drop_empty=True)
+
+    # Function to return the quantile sketches of the visible rows per partition, merged from every segment's sketches
+    # (of the segments up to `version` when given)
+    def sketches(self, version=None):
+        sketches = [load_partition_sketches(self._path(entry['sketches'])) for entry in self.entries[:version]]
+        return merge_partition_sketches(sketches, drop_empty=True)
+
+    # Function to yield (entry, rows) for every segment in ingestion order, starting after the given version
+    def iter_segments(self, since=0):
+        for entry in self.entries[since:]:
+            yield entry, pd.read_parquet(self._path(entry['segment']))
+
+    # Function to return the visible rows: every segment, with corrected rows replacing the originals
+    def rows(self):
+        frames = [rows for _, rows in self.iter_segments()]
+        if not frames:
+            return pd.DataFrame(columns=[rule.name for rule in self.schema.columns])
+        return apply_corrections(pd.concat(frames, ignore_index=True), self.key, self.has_corrections())
+
+    # Function to return the path of the snapshot of the current version's visible rows, writing it (and removing
+    # older snapshots) when it does not exist yet. Processes that read_snapshot() it share one copy of the rows
+    def snapshot(self):
+        with self._lock:
+            path = self._path('snapshots', f'{self.version:06d}.arrow')
+            if os.path.exists(path):
+                return path
+            os.makedirs(self._path('snapshots'), exist_ok=True)
+            # One record batch: readers map a column of a single chunk without copying it
+            table = pa.Table.from_pandas(self.rows(), preserve_index=False).combine_chunks()
+            temporary = f'{path}.{os.getpid()}.tmp'
+            with pa.ipc.new_file(temporary, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(temporary, path)
+            for name in os.listdir(self._path('snapshots')):
+                if name.endswith('.arrow') and name < os.path.basename(path):
+                    try:
+                        os.remove(self._path('snapshots', name))
+                    except OSError:
+                        pass  # Still mapped by a reader (Windows); removed with a later version
+            return path
+
+    # Function to tell whether any segment replaces rows of an earlier one
+    def has_corrections(self):
+        return any(entry['rows_replaced'] for entry in self.entries)
+
+    # Function to return the quarantined rows and the validation report of every ingested file
+    def validation(self):
+        report = ValidationReport()
+        quarantined = []
+        for entry in self.entries:
+            report.rows_checked += entry['rows_checked']
+            report.rows_quarantined += entry['rows_quarantined']
+            for column, check, rows in entry['violations']:
+                report.add(entry['file'], column, check, rows)
+            if entry['quarantine']:
+                quarantined.append(pd.read_parquet(self._path(entry['quarantine'])))
+        quarantined = pd.concat(quarantined, ignore_index=True) if quarantined else pd.DataFrame(columns=['violation'])
+        return quarantined, report
+
+
+# Function to drop the rows that a later segment replaced (rows must be in ingestion order)
+def apply_corrections(rows, key, has_corrections=True):
+    if not has_corrections:
+        return rows
+    return rows.drop_duplicates(key, keep='last').reset_index(drop=True)
+
+
+# Function to memory-map a snapshot as a DataFrame. Its numeric and string columns stay backed by the file's
+# pages, which the OS shares between every process that maps the file, instead of being copied into each one
+def read_snapshot(path):
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+# In-memory rows of a dataset for the dashboards, kept in sync with the manifest:
+# only segments added since the last update are read and appended
+class DatasetView:
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.rows = None
+        self.version = 0
+        self._lock = threading.Lock()
+
+    # Function to read the segments added since the last update, yielding (entry, rows so far) after each one
+    def iter_updates(self):
+        # The manifest is re-read before taking the view's lock: an ingest callback holds the dataset's lock
+        # and then takes the view's, so taking them in the other order here could deadlock
+        self.dataset.refresh()
+        with self._lock:
+            for entry, segment in self.dataset.iter_segments(since=self.version):
+                rows = segment if self.rows is None else pd.concat([self.rows, segment], ignore_index=True)
+                self.rows = apply_corrections(rows, self.dataset.key, entry['rows_replaced'] > 0)
+                self.version = entry['id']
+                yield entry, self.rows
+
+    # Function to return the current (rows, version), reading only new segments
+    def current(self):
+        for _ in self.iter_updates():
+            pass
+        if self.rows is None:
+            return self.dataset.rows(), self.version
+        return self.rows, self.version
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest year or correction files into an append-only dataset.")
+    parser.add_argument('command', choices=['ingest', 'status'])
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--dataset', default=os.path.join('datasets', 'insurance_v2'))
+    parser.add_argument('--schema', choices=sorted(SCHEMAS), default='insurance_v2')
+    parser.add_argument('--correction', action='store_true', help="rows replace earlier rows with the same year and sl")
+    parser.add_argument('--money', choices=MONEY_UNITS, help="store money as float units or int64 cents "
+                                                             "(new datasets only; defaults to $MONEY_UNITS or units)")
+    args = parser.parse_args()
+
+    dataset = Dataset(args.dataset, SCHEMAS[args.schema], money=args.money)
+    if args.command == 'ingest':
+        added = dataset.ingest(args.files, correction=args.correction, on_append=lambda entry: print(
+            f"Stored {entry['file']} as segment {entry['id']} ({entry['rows']} rows, {entry['rows_replaced']} replaced, "
+            f"{entry['rows_quarantined']} quarantined) in {entry['ingest_seconds']:.2f} s"))
+        print(f"{len(added)} new segment(s), {len(args.files) - len(added)} file(s) already up to date")
+
+    for entry in dataset.entries:
+        print(f"{entry['id']:>4} {entry['kind']:<10} {entry['file']} rows={entry['rows']} "
+              f"replaced={entry['rows_replaced']} quarantined={entry['rows_quarantined']}")
+    parts = dataset.partitions()
+    print(f"Total rows: {int(parts['row_count'].sum()) if not parts.empty else 0} (money in {dataset.money})")
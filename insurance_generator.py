@@ -0,0 +1,334 @@
+import argparse
+import os
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import claims_simulation
+from money import MONEY_COLUMNS, MONEY_UNITS, from_cents, to_cents
+
+# One generated column: its name, how it is sampled ('kind') and the sampler's parameters
+ColumnSpec = namedtuple('ColumnSpec', ['name', 'kind', 'params'])
+
+# A dataset variant: its columns, default size, years and output file name pattern
+# (`column_order` is the written order when it differs from the sampling order)
+Preset = namedtuple('Preset', ['columns', 'rows', 'years', 'file_pattern', 'split_by_year', 'column_order'],
+                    defaults=[None])
+
+INSURED_TYPES = ['Health', 'Life', 'Auto', 'Property']
+INSURED_GROUPS = ['Group A', 'Group B', 'Group C', 'Group D']
+
+# Claim frequency (claims per insured unit) and severity (mean cost per claim) for the actuarial preset
+CLAIM_FREQUENCY = {
+    'exposure': 'insured', 'by': 'insured_type', 'distribution': 'negative_binomial', 'dispersion': 2.0,
+    'rate': {'Health': 0.03, 'Life': 0.002, 'Auto': 0.02, 'Property': 0.008},
+}
+CLAIM_SEVERITY = {
+    'by': 'insured_type', 'distribution': 'lognormal', 'sigma': 1.2,
+    'mean': {'Health': 400, 'Life': 25000, 'Auto': 1800, 'Property': 6000},
+}
+
+# Columns shared by the v2 and 10M-row variants
+V2_COLUMNS = [
+    ColumnSpec('sl', 'sequence', {'start': 1}),
+    ColumnSpec('insured_type', 'choice', {'values': INSURED_TYPES}),
+    ColumnSpec('insured_group', 'choice', {'values': INSURED_GROUPS}),
+    ColumnSpec('year', 'year', {}),
+    ColumnSpec('loss_ratio', 'uniform', {'low': 0, 'high': 1}),  # Loss ratio between 0 and 1
+    ColumnSpec('filter_loss_ratio', 'uniform', {'low': 0, 'high': 1}),
+    ColumnSpec('profit', 'uniform', {'low': -1000000, 'high': 1000000}),  # Profit can be negative or positive
+    ColumnSpec('insured', 'integers', {'low': 1, 'high': 1000}),
+    ColumnSpec('gwp', 'uniform', {'low': 10000, 'high': 50000}),  # Gross written premium between 10k and 50k
+    ColumnSpec('claim_count', 'integers', {'low': 0, 'high': 100}),
+]
+
+PRESETS = {
+    # generate_insured_data.py: one file, the year is drawn per row
+    'original': Preset(
+        columns=[
+            ColumnSpec('sl', 'sequence', {'start': 1}),
+            ColumnSpec('insured_type', 'choice', {'values': ['Health', 'Life', 'Property']}),
+            ColumnSpec('insured_group', 'choice', {'values': ['Individual', 'Family', 'Corporate']}),
+            ColumnSpec('year', 'year', {}),
+            ColumnSpec('loss_ratio', 'uniform', {'low': 0, 'high': 100, 'decimals': 2}),  # Loss ratio in percentage
+            ColumnSpec('filter_loss_ratio', 'uniform', {'low': 0, 'high': 100, 'decimals': 2}),
+            ColumnSpec('profit', 'uniform', {'low': -10000, 'high': 50000, 'decimals': 2}),
+            ColumnSpec('insured', 'integers', {'low': 100, 'high': 5001}),
+            ColumnSpec('gwp', 'integers', {'low': 100000, 'high': 5000001}),
+            ColumnSpec('claim_count', 'integers', {'low': 0, 'high': 201}),
+        ],
+        rows=100,
+        years=list(range(2010, 2024)),
+        file_pattern='insurance_data',
+        split_by_year=False,
+    ),
+    # generate_insured_data_v2.py
+    'v2': Preset(
+        columns=V2_COLUMNS,
+        rows=10000,
+        years=[2020, 2021, 2022, 2023, 2024],
+        file_pattern='insurance_data_v2_{year}',
+        split_by_year=True,
+    ),
+    # generate_insured_data_xl2.py: loss ratio is derived from "Total Incurred" and stored as "NN %"
+    'xl2': Preset(
+        columns=[
+            ColumnSpec('sl', 'sequence', {'start': 1}),
+            ColumnSpec('insured_type', 'choice', {'values': INSURED_TYPES}),
+            ColumnSpec('insured_group', 'choice', {'values': INSURED_GROUPS}),
+            ColumnSpec('year', 'year', {}),
+            ColumnSpec('filter_loss_ratio', 'uniform', {'low': 0, 'high': 1}),
+            ColumnSpec('profit', 'uniform', {'low': -1000000, 'high': 1000000}),
+            ColumnSpec('insured', 'integers', {'low': 1, 'high': 1000}),
+            ColumnSpec('gwp', 'uniform', {'low': 10000, 'high': 50000}),
+            ColumnSpec('claim_count', 'integers', {'low': 0, 'high': 100}),
+            ColumnSpec('total_incurred', 'fraction_of', {'column': 'gwp'}),  # Always less than "gwp"
+            ColumnSpec('loss_ratio', 'percent_label', {'numerator': 'total_incurred', 'denominator': 'gwp'}),
+        ],
+        rows=10000,
+        years=[2020, 2021, 2022, 2023, 2024],
+        file_pattern='insurance_data_xl2_{year}',
+        split_by_year=True,
+    ),
+    # xl2 schema with simulated claims: counts and incurred losses are drawn per policy,
+    # and gwp, profit and loss ratio are derived from them consistently
+    'actuarial': Preset(
+        columns=[
+            ColumnSpec('sl', 'sequence', {'start': 1}),
+            ColumnSpec('insured_type', 'choice', {'values': INSURED_TYPES}),
+            ColumnSpec('insured_group', 'choice', {'values': INSURED_GROUPS}),
+            ColumnSpec('year', 'year', {}),
+            ColumnSpec('filter_loss_ratio', 'uniform', {'low': 0, 'high': 1}),
+            ColumnSpec('insured', 'integers', {'low': 1, 'high': 1000}),
+            ColumnSpec('gwp', 'premium', {'frequency': CLAIM_FREQUENCY, 'severity': CLAIM_SEVERITY,
+                                          'target_loss_ratio': 0.65, 'spread': 0.15}),
+            ColumnSpec('claim_count', 'claim_counts', CLAIM_FREQUENCY),
+            ColumnSpec('total_incurred', 'incurred', dict(CLAIM_SEVERITY, counts='claim_count')),
+            ColumnSpec('profit', 'profit', {'premium': 'gwp', 'losses': 'total_incurred', 'expense_ratio': 0.25}),
+            ColumnSpec('loss_ratio', 'percent_label', {'numerator': 'total_incurred', 'denominator': 'gwp'}),
+        ],
+        rows=10000000,
+        years=[2020, 2021, 2022, 2023, 2024],
+        file_pattern='insurance_data_actuarial_{year}',
+        split_by_year=True,
+        column_order=['sl', 'insured_type', 'insured_group', 'year', 'filter_loss_ratio', 'profit', 'insured', 'gwp',
+                      'claim_count', 'total_incurred', 'loss_ratio'],
+    ),
+    # generate_multiple_file_data.py: the v2 schema at 10 million rows per year
+    'multi': Preset(
+        columns=V2_COLUMNS,
+        rows=10000000,
+        years=[2020, 2021, 2022, 2023, 2024],
+        file_pattern='insurance_data_{year}',
+        split_by_year=True,
+    ),
+}
+
+# Rows per generation block. Every block draws from its own counter range of one Philox stream per (seed, year),
+# so row i depends only on the seed, the year and i: any row range can be generated on its own, in any order
+# or process (or machine), and comes out identical to the same rows of a full run
+BLOCK_ROWS = 1 << 16
+
+# Rows generated and written at a time, so memory stays bounded for very large files (a whole number of blocks)
+DEFAULT_CHUNK_ROWS = 16 * BLOCK_ROWS
+
+
+# Function to sample one column of a chunk (vectorized; `columns` holds the columns sampled so far)
+def sample_column(spec, rng, num_rows, columns, year, years, row_offset):
+    params = spec.params
+    if spec.kind == 'sequence':
+        return np.arange(params['start'] + row_offset, params['start'] + row_offset + num_rows)
+    if spec.kind == 'year':
+        if year is not None:
+            return np.full(num_rows, year)
+        return np.asarray(years)[rng.integers(0, len(years), num_rows)]
+    if spec.kind == 'choice':
+        # Categorical codes keep memory at one byte per row instead of one Python string
+        return pd.Categorical.from_codes(rng.integers(0, len(params['values']), num_rows), params['values'])
+    if spec.kind == 'uniform':
+        values = rng.uniform(params['low'], params['high'], num_rows)
+        return np.round(values, params['decimals']) if 'decimals' in params else values
+    if spec.kind == 'integers':
+        return rng.integers(params['low'], params['high'], num_rows)  # `high` is exclusive
+    if spec.kind == 'fraction_of':
+        return rng.uniform(0, 1, num_rows) * columns[params['column']]
+    if spec.kind == 'percent_label':
+        # Percentage rounded to the nearest integer, shown as e.g. "42 %"
+        percent = np.round(columns[params['numerator']] / columns[params['denominator']] * 100).astype(np.int64)
+        low, high = (int(percent.min()), int(percent.max())) if num_rows else (0, 0)
+        labels = [f"{value} %" for value in range(low, high + 1)]
+        return pd.Categorical.from_codes(percent - low, labels)
+    if spec.kind == 'claim_counts':
+        return claims_simulation.sample_claim_counts(params, rng, columns, num_rows)
+    if spec.kind == 'incurred':
+        return claims_simulation.sample_incurred(params, rng, columns, num_rows)
+    if spec.kind == 'premium':
+        return claims_simulation.sample_premium(params, rng, columns, num_rows)
+    if spec.kind == 'profit':
+        return claims_simulation.underwriting_profit(params, columns)
+    raise ValueError(f"Unknown column kind: {spec.kind}")
+
+
+# Function to generate one chunk of rows as a DataFrame.
+# With money='cents' every amount is a whole number of cents, and the money columns are int64 cents
+def generate_chunk(columns, num_rows, rng, year=None, years=None, row_offset=0, column_order=None, money='units'):
+    data = {}
+    for spec in columns:
+        values = sample_column(spec, rng, num_rows, data, year, years, row_offset)
+        if money == 'cents' and spec.name in MONEY_COLUMNS:
+            values = np.round(values, 2)  # Rounded as sampled, so derived columns are computed from the stored amounts
+        data[spec.name] = values
+    if money == 'cents':
+        for name in MONEY_COLUMNS:
+            if name in data:
+                data[name] = to_cents(data[name])
+    df = pd.DataFrame(data)
+    return df[column_order] if column_order else df
+
+
+# Function to draw a fresh seed (for runs without one; it is printed so the run can be reproduced)
+def random_seed():
+    return np.random.SeedSequence().entropy
+
+
+# Function to create the generator of one block: the (seed, year) Philox stream with its counter advanced
+# to the block's own range (2**64 steps per block, far more than a block ever draws), so blocks never overlap
+def block_rng(seed, year, block_index):
+    key = np.random.SeedSequence([seed, year or 0]).generate_state(2, np.uint64)
+    bit_generator = np.random.Philox(key=key)
+    bit_generator.advance(block_index << 64)
+    return np.random.Generator(bit_generator)
+
+
+# Function to generate rows [start, stop) of one year (or of the all-years file when `year` is None).
+# Whole blocks are always sampled, since a column's draws depend on how many rows are sampled at once,
+# and then cut to the range (runs in a worker process when generating in parallel)
+def generate_rows(preset, start, stop, seed, year=None, money='units'):
+    frames = []
+    for block_index in range(start // BLOCK_ROWS, -(-stop // BLOCK_ROWS)):
+        block_start = block_index * BLOCK_ROWS
+        block = generate_chunk(preset.columns, BLOCK_ROWS, block_rng(seed, year, block_index), year=year,
+                               years=preset.years, row_offset=block_start, column_order=preset.column_order, money=money)
+        frames.append(block.iloc[max(start - block_start, 0):stop - block_start])
+    if not frames:
+        return generate_chunk(preset.columns, 0, block_rng(seed, year, 0), year=year, years=preset.years,
+                              row_offset=start, column_order=preset.column_order, money=money)
+    return pd.concat(frames, ignore_index=True)
+
+
+# Function to generate `num_rows` rows, starting at row `start_row`, for one year (or for all preset years
+# when `year` is None). The rows do not depend on the chunk size or on how many workers are used
+def iter_chunks(preset, num_rows, seed=None, year=None, chunk_rows=DEFAULT_CHUNK_ROWS, workers=1, money='units',
+                start_row=0):
+    seed = random_seed() if seed is None else seed
+    # Chunks end on block boundaries, so no block is sampled twice
+    chunk_rows = max(BLOCK_ROWS, chunk_rows // BLOCK_ROWS * BLOCK_ROWS)
+    stop_row = start_row + num_rows
+    boundaries = [start_row] + list(range((start_row // chunk_rows + 1) * chunk_rows, stop_row, chunk_rows)) + [stop_row]
+    tasks = [(preset, start, stop, seed, year, money) for start, stop in zip(boundaries, boundaries[1:])]
+    if workers <= 1:
+        for task in tasks:
+            yield generate_rows(*task)
+        return
+
+    # Keep only a few chunks in flight so memory stays bounded, and yield them in row order
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(generate_rows, *task))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# Function to generate a whole DataFrame in memory (convenient for small datasets)
+def generate_data(preset, num_rows=None, seed=None, year=None, money='units'):
+    num_rows = preset.rows if num_rows is None else num_rows
+    return pd.concat(iter_chunks(preset, num_rows, seed=seed, year=year, money=money), ignore_index=True)
+
+
+# Function to write chunks to a CSV or Parquet file without holding the whole file in memory.
+# Files always hold money in units: cents are written as amounts with at most two decimals, which read back exactly
+def write_chunks(chunks, path, output_format, money='units'):
+    import pyarrow as pa
+
+    writer = None
+    try:
+        for chunk in chunks:
+            if money == 'cents':
+                chunk = chunk.assign(**{name: from_cents(chunk[name]) for name in MONEY_COLUMNS if name in chunk})
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            # Categories can differ between chunks, so write categorical columns as plain strings
+            # (Parquet dictionary-encodes them again on its own)
+            for index, field in enumerate(table.schema):
+                if pa.types.is_dictionary(field.type):
+                    table = table.set_column(index, field.name, table[field.name].cast(field.type.value_type))
+            if writer is None:
+                if output_format == 'parquet':
+                    import pyarrow.parquet as pq
+                    writer = pq.ParquetWriter(path, table.schema)
+                else:
+                    import pyarrow.csv as pacsv
+                    writer = pacsv.CSVWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+# Function to generate and write every file of a preset, returning the written paths.
+# With `start_row`, only rows [start_row, start_row + num_rows) of each file are written (to a "_rows_<start>-<stop>"
+# file); with the same seed they are identical to those rows of the full file, e.g. to shard generation across
+# machines or to regenerate one damaged range
+def write_dataset(preset, num_rows=None, years=None, seed=None, output_format='csv', output_dir='.',
+                  chunk_rows=DEFAULT_CHUNK_ROWS, workers=1, money='units', start_row=None):
+    num_rows = preset.rows if num_rows is None else num_rows
+    years = preset.years if years is None else years
+    if not preset.split_by_year:
+        preset = preset._replace(years=years)
+    if seed is None:
+        seed = random_seed()
+        print(f"Seed: {seed} (pass --seed {seed} to generate the same data again)")
+    os.makedirs(output_dir, exist_ok=True)
+
+    paths = []
+    for year in (years if preset.split_by_year else [None]):
+        name = preset.file_pattern.format(year=year)
+        if start_row is not None:
+            name += f'_rows_{start_row}-{start_row + num_rows}'
+        path = os.path.join(output_dir, name + '.' + output_format)
+
+        chunks = iter_chunks(preset, num_rows, seed=seed, year=year, chunk_rows=chunk_rows, workers=workers, money=money,
+                             start_row=start_row or 0)
+        write_chunks(chunks, path, output_format, money=money)
+        print(f"Generated {output_format.upper()} for {'year ' + str(year) if year else 'all years'}: {path}")
+        paths.append(path)
+    return paths
+
+
+# Command line entry point; the old generator scripts call this with their own preset
+def main(argv=None, default_preset='v2', default_seed=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic insurance data files.")
+    parser.add_argument('--preset', choices=sorted(PRESETS), default=default_preset)
+    parser.add_argument('--rows', type=int, help="rows per file (defaults to the preset's size)")
+    parser.add_argument('--start-row', type=int, help="generate only rows START_ROW to START_ROW + ROWS of each file")
+    parser.add_argument('--years', type=int, nargs='+', help="years to generate (defaults to the preset's years)")
+    parser.add_argument('--seed', type=int, default=default_seed, help="seed for reproducible output")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--workers', type=int, default=1, help="worker processes (0 uses every core)")
+    parser.add_argument('--money', choices=MONEY_UNITS, default='units',
+                        help="'cents' generates every amount as a whole number of cents (exact when ingested in cents)")
+    args = parser.parse_args(argv)
+
+    write_dataset(PRESETS[args.preset], num_rows=args.rows, years=args.years, seed=args.seed,
+                  output_format=args.format, output_dir=args.output_dir, chunk_rows=args.chunk_rows,
+                  workers=args.workers or os.cpu_count() or 1, money=args.money, start_row=args.start_row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from data_validation import KeyTracker, ValidationReport, validate_chunk
+
+
+# Function to stream a file (CSV or Parquet) as pyarrow tables of about `block_size` bytes / `chunk_rows` rows.
+# The schema's columns are read as strings, so malformed values reach the checks instead of failing the read
+def iter_file_chunks(file, schema, block_size=16 << 20, chunk_rows=1 << 20):
+    if os.path.splitext(file)[1].lower() == '.parquet':
+        for batch in pq.ParquetFile(file).iter_batches(batch_size=chunk_rows):
+            yield pa.Table.from_batches([batch])
+        return
+    reader = pa_csv.open_csv(
+        file,
+        read_options=pa_csv.ReadOptions(block_size=block_size),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={rule.name: pa.string() for rule in schema.columns},
+            strings_can_be_null=True,
+        ),
+    )
+    for batch in reader:
+        yield pa.Table.from_batches([batch])
+
+
+# Function to read and validate one file in a single pass over its chunks.
+# Returns (valid rows, quarantined rows with a 'violation' column, ValidationReport)
+def read_validated_file(file, schema):
+    report = ValidationReport()
+    tracker = KeyTracker()  # Duplicate keys are checked per file (every year file starts at sl 1)
+    valid, quarantined = [], []
+    for table in iter_file_chunks(file, schema):
+        good, bad = validate_chunk(table, schema, file, report, tracker)
+        valid.append(good)
+        if not bad.empty:
+            quarantined.append(bad)
+    if not valid:
+        # An empty file still yields its (empty) columns
+        valid.append(pd.DataFrame(columns=[rule.name for rule in schema.columns]))
+    df = pd.concat(valid, ignore_index=True)
+    quarantined = pd.concat(quarantined, ignore_index=True) if quarantined else pd.DataFrame(columns=list(df.columns) + ['violation'])
+    return df, quarantined, report
@@ -0,0 +1,178 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+import pandas as pd
+
+from insurance_aggregates import apply_filters
+
+# Structured form of a free-text question
+QueryIntent = namedtuple('QueryIntent', ['metric', 'aggregation', 'group_by', 'chart', 'years', 'insured_types'])
+
+# Phrases for each metric column
+METRIC_PHRASES = {
+    'gross written premium': 'gwp',
+    'gwp': 'gwp',
+    'premium': 'gwp',
+    'loss ratio': 'loss_ratio',
+    'total incurred': 'total_incurred',
+    'incurred': 'total_incurred',
+    'claim count': 'claim_count',
+    'claims': 'claim_count',
+    'profit': 'profit',
+    'insured': 'insured',
+}
+
+# Phrases for each aggregation
+AGGREGATION_PHRASES = {
+    'average': 'mean',
+    'avg': 'mean',
+    'mean': 'mean',
+    'number of': 'count',
+    'count of': 'count',
+    'highest': 'max',
+    'maximum': 'max',
+    'max': 'max',
+    'lowest': 'min',
+    'minimum': 'min',
+    'min': 'min',
+    'total': 'sum',
+    'sum': 'sum',
+}
+
+# Phrases for each group-by dimension
+GROUP_BY_PHRASES = {
+    'insured type': 'insured_type',
+    'insured group': 'insured_group',
+    'year wise': 'year',
+    'yearwise': 'year',
+    'per year': 'year',
+    'by year': 'year',
+    'yearly': 'year',
+    'each year': 'year',
+    'type wise': 'insured_type',
+    'by type': 'insured_type',
+    'per type': 'insured_type',
+    'group wise': 'insured_group',
+    'by group': 'insured_group',
+    'per group': 'insured_group',
+}
+
+# Phrases for each chart type
+CHART_PHRASES = {
+    'pie': 'pie',
+    'bar': 'bar',
+    'line': 'line',
+    'trend': 'line',
+    'table': 'table',
+}
+
+# Metrics whose natural aggregation is an average rather than a sum
+DEFAULT_MEAN_METRICS = {'loss_ratio'}
+
+# Metrics that are counts already, so "number of claims" sums them instead of counting rows
+COUNT_METRICS = {'claim_count'}
+
+YEAR_PATTERN = re.compile(r'\b(?:19|20)\d{2}\b')
+
+
+# Function to find the earliest phrase of the vocabulary in the text (the longest one wins at the same position)
+def match_phrase(text, phrases):
+    best = None
+    for phrase, value in phrases.items():
+        match = re.search(r'\b' + re.escape(phrase) + r'\b', text)
+        if match and (best is None or (match.start(), -len(phrase)) < best[0]):
+            best = ((match.start(), -len(phrase)), value)
+    return best[1] if best else None
+
+
+# Function to blank out every phrase of the vocabulary from the text
+def remove_phrases(text, phrases):
+    for phrase in phrases:
+        text = re.sub(r'\b' + re.escape(phrase) + r'\b', ' ', text)
+    return text
+
+
+# Function to normalize a question so that trivially different spellings share one cache entry
+def normalize_query(text):
+    text = text.lower().replace('-', ' ').replace('_', ' ')
+    text = re.sub(r'[^a-z0-9 ]+', ' ', text)
+    return ' '.join(text.split())
+
+
+# Function to parse a normalized question into a QueryIntent (None when no metric is mentioned)
+@lru_cache(maxsize=256)
+def parse_normalized_query(text, known_insured_types=()):
+    # Match the group-by first, so "insured type" is not read as the "insured" metric
+    group_by = match_phrase(text, GROUP_BY_PHRASES)
+    metric = match_phrase(remove_phrases(text, GROUP_BY_PHRASES), METRIC_PHRASES)
+    if metric is None:
+        return None
+
+    aggregation = match_phrase(text, AGGREGATION_PHRASES)
+    if aggregation is None:
+        aggregation = 'mean' if metric in DEFAULT_MEAN_METRICS else 'sum'
+    elif aggregation == 'count' and metric in COUNT_METRICS:
+        aggregation = 'sum'
+
+    chart = match_phrase(text, CHART_PHRASES)
+    if chart is None:
+        chart = 'bar' if group_by else 'table'
+
+    years = tuple(sorted({int(year) for year in YEAR_PATTERN.findall(text)}))
+    insured_types = tuple(sorted(
+        insured_type for insured_type in known_insured_types
+        if re.search(r'\b' + re.escape(insured_type.lower()) + r'\b', text)
+    ))
+
+    return QueryIntent(metric, aggregation, group_by, chart, years, insured_types)
+
+
+# Function to parse a free-text question into a QueryIntent
+def parse_query(text, known_insured_types=()):
+    return parse_normalized_query(normalize_query(text), tuple(sorted(known_insured_types)))
+
+
+# Function to narrow the dashboard filters with the filters mentioned in the question
+def intent_filters(filters, intent):
+    years, insured_types, loss_ratio_range = filters
+    if intent.years:
+        years = tuple(year for year in years if year in intent.years)
+    if intent.insured_types:
+        insured_types = tuple(insured_type for insured_type in insured_types if insured_type in intent.insured_types)
+    return years, insured_types, loss_ratio_range
+
+
+# Function to compute the answer to an intent (a scalar, or a Series indexed by the group-by dimension)
+def compute_intent(df, filters, intent):
+    filtered_df = apply_filters(df, intent_filters(filters, intent))
+    if filtered_df.empty:
+        # Nothing selected (e.g. a year without data): no value, or no groups
+        if intent.group_by is None:
+            return {'result': float('nan')}
+        return {'result': pd.Series(dtype=float, name=intent.metric, index=pd.Index([], name=intent.group_by))}
+    column = filtered_df[intent.metric]
+    if intent.group_by is None:
+        return {'result': column.agg(intent.aggregation)}
+    return {'result': column.groupby(filtered_df[intent.group_by]).agg(intent.aggregation)}
+
+
+# Function to answer an intent through the shared aggregate memo
+def answer_intent(memo, dataset_key, df, filters, intent):
+    # The memo key includes the intent, so repeated or similar questions reuse the result
+    aggregates = memo.get_or_compute(dataset_key, ('query', filters, intent), lambda: compute_intent(df, filters, intent))
+    return aggregates['result']
+
+
+# Function to build a readable title for an intent
+def describe_intent(intent):
+    aggregation_names = {'sum': 'Total', 'mean': 'Average', 'count': 'Count of', 'max': 'Maximum', 'min': 'Minimum'}
+    metric_name = 'GWP' if intent.metric == 'gwp' else intent.metric.replace('_', ' ').title()
+    title = f"{aggregation_names[intent.aggregation]} {metric_name}"
+    if intent.group_by:
+        title += f" by {intent.group_by.replace('_', ' ').title()}"
+    if intent.years:
+        title += f" ({', '.join(str(year) for year in intent.years)})"
+    if intent.insured_types:
+        title += f" [{', '.join(intent.insured_types)}]"
+    return title
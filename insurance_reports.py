@@ -0,0 +1,116 @@
+import argparse
+import base64
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from data_validation import SCHEMAS
+from insurance_aggregates import aggregates_in_units, combine_partitions
+from insurance_charts import plot_profit_loss_by_type, plot_yearly_gwp
+from insurance_dataset import Dataset
+
+# Same files and dataset as the xl2 dashboard
+DEFAULT_FILES = ['insurance_data_xl2_2020.csv', 'insurance_data_xl2_2021.csv', 'insurance_data_xl2_2022.csv']
+DEFAULT_DATASET = os.path.join('datasets', 'insurance_xl2')
+
+
+# Function to list every report: each year x insured_type combination, plus "All" for each dimension
+def report_selections(parts):
+    years = sorted(int(year) for year in parts['year'].unique())
+    insured_types = sorted(str(insured_type) for insured_type in parts['insured_type'].unique())
+    selections = []
+    for year in [None] + years:
+        for insured_type in [None] + insured_types:
+            selections.append((
+                f"{year or 'all_years'}_{insured_type or 'all_types'}",
+                [year] if year else years,
+                [insured_type] if insured_type else insured_types,
+            ))
+    return selections
+
+
+# Function to render one report to PNG and/or HTML files (runs in a worker process)
+def render_report(name, aggregates, output_dir, formats):
+    import matplotlib
+    matplotlib.use('Agg')  # Headless backend, selected before the charts import pyplot
+    import matplotlib.pyplot as plt
+
+    start = time.perf_counter()
+    images = {}
+    for chart_name, plot in (('yearly_gwp', plot_yearly_gwp), ('profit_loss_by_type', plot_profit_loss_by_type)):
+        fig = plot(aggregates)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', bbox_inches='tight')
+        plt.close(fig)
+        images[chart_name] = buffer.getvalue()
+        if 'png' in formats:
+            with open(os.path.join(output_dir, f"{name}_{chart_name}.png"), 'wb') as png_file:
+                png_file.write(images[chart_name])
+
+    if 'html' in formats:
+        # Loss ratio tables, formatted like the dashboard's tables
+        totals = pd.DataFrame({
+            "Metric": ["Total GWP", "Average Loss Ratio"],
+            "Value": [f"${aggregates['total_gwp']:,.2f}", f"{aggregates['average_loss_ratio']:.2f} %"]
+        })
+        yearly_summary = aggregates['yearly_summary'].copy()
+        yearly_summary['average_loss_ratio'] = yearly_summary['average_loss_ratio'].round(2).astype(str) + " %"
+
+        charts = "".join(
+            f'<img src="data:image/png;base64,{base64.b64encode(image).decode()}" alt="{chart_name}">'
+            for chart_name, image in images.items()
+        )
+        html = (
+            f"<html><head><title>Insurance Report {name}</title></head><body>"
+            f"<h1>Insurance Report: {name}</h1><p>Rows: {aggregates['row_count']}</p>"
+            f"<h2>Total GWP and Loss Ratio</h2>{totals.to_html(index=False)}"
+            f"<h2>Total GWP and Loss Ratio by Year</h2>{yearly_summary.to_html(index=False)}"
+            f"<h2>Charts</h2>{charts}</body></html>"
+        )
+        with open(os.path.join(output_dir, f"{name}.html"), 'w') as html_file:
+            html_file.write(html)
+
+    return name, time.perf_counter() - start
+
+
+# Function to generate every report: the partition aggregates come from the dataset's manifest
+# (only new or changed files are read), then the reports are rendered in parallel
+def generate_reports(files=DEFAULT_FILES, output_dir='reports', formats=('html', 'png'), workers=None,
+                     dataset_dir=DEFAULT_DATASET):
+    os.makedirs(output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    dataset = Dataset(dataset_dir, SCHEMAS['insurance_xl2'])
+    dataset.ingest(files)
+    parts = dataset.partitions()
+    # The partitions are merged exactly (in cents when the dataset stores them so) before converting for display
+    reports = [(name, aggregates_in_units(combine_partitions(parts, years, insured_types), dataset.money))
+               for name, years, insured_types in report_selections(parts)]
+    print(f"Aggregated {len(reports)} reports in {time.perf_counter() - start:.2f} s")
+
+    # Only the small per-report aggregates are sent to the workers, never the rows
+    timings = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(render_report, name, aggregates, output_dir, formats) for name, aggregates in reports]
+        for future in as_completed(futures):
+            name, seconds = future.result()
+            timings[name] = seconds
+            print(f"Rendered {name} in {seconds:.2f} s")
+
+    print(f"Generated {len(reports)} reports in {time.perf_counter() - start:.2f} s")
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the xl2 dashboard reports for every year x insured type.")
+    parser.add_argument('files', nargs='*', default=DEFAULT_FILES)
+    parser.add_argument('--output-dir', default='reports')
+    parser.add_argument('--formats', nargs='+', choices=['html', 'png'], default=['html', 'png'])
+    parser.add_argument('--workers', type=int, help="worker processes (defaults to every core)")
+    parser.add_argument('--dataset', default=DEFAULT_DATASET, help="append-only dataset directory")
+    args = parser.parse_args()
+
+    generate_reports(args.files, args.output_dir, args.formats, args.workers, args.dataset)
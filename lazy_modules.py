@@ -0,0 +1,74 @@
+import importlib
+import subprocess
+import sys
+import time
+
+from dashboard_timing import span
+
+# Seconds spent importing each lazily loaded module in this process (0.0 when it was already imported)
+import_times = {}
+
+
+# Function to import a module, recording how long the import took
+def load_module(name):
+    module = sys.modules.get(name)
+    if module is not None:
+        import_times.setdefault(name, 0.0)
+        return module
+
+    # The import also shows up as a stage of the current rerun in the timing panel
+    start = time.perf_counter()
+    with span(f'import {name}'):
+        module = importlib.import_module(name)
+    import_times[name] = time.perf_counter() - start
+    return module
+
+
+# Stand-in for a module that is only imported on first attribute access
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = load_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+# Function to declare a module that should be imported only when it is first used
+def lazy_import(name):
+    return LazyModule(name)
+
+
+# Function to measure the cold import cost of each module in a fresh interpreter
+def measure_import_costs(names):
+    costs = {}
+    for name in names:
+        code = (
+            "import time; start = time.perf_counter(); "
+            f"import {name}; "
+            "print(time.perf_counter() - start)"
+        )
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+        costs[name] = float(result.stdout.strip()) if result.returncode == 0 else None
+    return costs
+
+
+# Modules the dashboards import, in the order they are usually loaded
+DASHBOARD_MODULES = [
+    'streamlit', 'pandas', 'numpy', 'pyarrow',
+    'matplotlib.pyplot', 'seaborn', 'plotly.express', 'plotly.figure_factory',
+]
+
+if __name__ == "__main__":
+    # Report the cold import cost per module, e.g. `python lazy_modules.py seaborn plotly.express`
+    for name, seconds in measure_import_costs(sys.argv[1:] or DASHBOARD_MODULES).items():
+        if seconds is None:
+            print(f"{name:<25} not installed")
+        else:
+            print(f"{name:<25} {seconds * 1000:8.1f} ms")
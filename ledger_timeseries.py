@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+
+# Formats of the 'Date' column: bank statements use day-first dates, live rows use timestamps
+DATE_FORMATS = ['%d-%m-%Y', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d']
+
+
+# Function to parse the 'Date' column into datetimes (unparseable dates become NaT); columns already
+# holding datetimes (e.g. from ExpenseStore.frame) are returned as they are
+def parse_timestamps(dates):
+    dates = pd.Series(dates)
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        return dates.astype('datetime64[ns]')
+    dates = dates.astype(str)
+    parsed = pd.Series(pd.NaT, index=dates.index, dtype='datetime64[ns]')
+    for date_format in DATE_FORMATS:
+        missing = parsed.isna()
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(dates[missing], format=date_format, errors='coerce')
+    return parsed
+
+
+# Function to parse the 'Date' column into day-resolution datetimes (unparseable dates become NaT)
+def parse_dates(dates):
+    return parse_timestamps(dates).dt.normalize()
+
+
+# Daily totals for one dimension (e.g. Category): a growable (days x keys) array
+class DailyBuckets:
+    def __init__(self, capacity_days=64, capacity_keys=8):
+        self.keys = []
+        self.key_index = {}
+        self.values = np.zeros((capacity_days, capacity_keys))
+
+    # Function to map a batch of keys to column indices, adding columns for unseen keys
+    def codes_for(self, keys):
+        codes, uniques = pd.factorize(pd.Series(keys), use_na_sentinel=False)
+        columns = np.empty(len(uniques), dtype=np.int64)
+        for position, key in enumerate(uniques):
+            if key not in self.key_index:
+                self.key_index[key] = len(self.keys)
+                self.keys.append(key)
+            columns[position] = self.key_index[key]
+        self.reserve(self.values.shape[0], len(self.keys))
+        return columns[codes]
+
+    # Function to grow the array (doubling) so it holds at least the given number of days and keys
+    def reserve(self, days, keys):
+        capacity_days, capacity_keys = self.values.shape
+        if days <= capacity_days and keys <= capacity_keys:
+            return
+        while capacity_days < days:
+            capacity_days *= 2
+        while capacity_keys < keys:
+            capacity_keys *= 2
+        values = np.zeros((capacity_days, capacity_keys))
+        values[:self.values.shape[0], :self.values.shape[1]] = self.values
+        self.values = values
+
+    # Function to insert empty days at the front (when a transaction is older than the first stored day)
+    def prepend_days(self, count):
+        self.values = np.concatenate([np.zeros((count, self.values.shape[1])), self.values])
+
+    # Function to add amounts into their (day, key) buckets
+    def add(self, day_index, keys, amounts):
+        columns = self.codes_for(keys)
+        self.reserve(int(day_index.max()) + 1, len(self.keys))
+        np.add.at(self.values, (day_index, columns), amounts)
+
+
+# Time-bucketed spend store for a transaction ledger, updated incrementally as rows arrive
+class SpendStore:
+    def __init__(self):
+        self.start = None  # Date of the first stored day
+        self.num_days = 0
+        self.by_category = DailyBuckets()
+        self.by_customer = DailyBuckets()
+
+    # Function to add transactions (sign=-1 removes them again, e.g. when an expense is deleted)
+    def add_transactions(self, transactions, sign=1):
+        # Only debits count as spend
+        debits = transactions[transactions['Dr/Cr'] == 'Dr']
+        dates = parse_dates(debits['Date'])
+        valid = dates.notna().to_numpy()
+        if not valid.any():
+            return
+        dates = dates[valid]
+        debits = debits[valid]
+
+        first_day, last_day = dates.min(), dates.max()
+        if self.start is None:
+            self.start = first_day
+        elif first_day < self.start:
+            # Shift the stored days so the older transactions fit in front
+            shift = (self.start - first_day).days
+            self.by_category.prepend_days(shift)
+            self.by_customer.prepend_days(shift)
+            self.start = first_day
+            self.num_days += shift
+
+        day_index = ((dates - self.start).dt.days).to_numpy()
+        amounts = sign * pd.to_numeric(debits['Amount'], errors='coerce').fillna(0).to_numpy(dtype=float)
+        self.by_category.add(day_index, debits['Category'].to_numpy(), amounts)
+        self.by_customer.add(day_index, debits['CustomerId'].to_numpy(), amounts)
+        self.num_days = max(self.num_days, (last_day - self.start).days + 1)
+
+    # Function to get the buckets of a dimension ('category' or 'customer')
+    def buckets(self, dimension):
+        return self.by_category if dimension == 'category' else self.by_customer
+
+    # Function to return daily spend as a DataFrame (one row per day, one column per key)
+    def daily(self, dimension='category'):
+        buckets = self.buckets(dimension)
+        index = pd.date_range(self.start, periods=self.num_days, freq='D', name='Date') if self.start is not None else []
+        return pd.DataFrame(buckets.values[:self.num_days, :len(buckets.keys)], index=index, columns=buckets.keys)
+
+    # Function to return monthly spend, summed from the daily buckets
+    def monthly(self, dimension='category'):
+        daily = self.daily(dimension)
+        if daily.empty:
+            return daily
+        months = daily.index.to_period('M')
+        # Days are sorted, so every month is one contiguous block of rows
+        starts = np.flatnonzero(np.r_[True, months[1:] != months[:-1]])
+        values = np.add.reduceat(daily.to_numpy(), starts, axis=0)
+        return pd.DataFrame(values, index=pd.PeriodIndex(months[starts], name='Month'), columns=daily.columns)
+
+    # Function to return the spend over a rolling window of `window_days` days ending on each day
+    def rolling(self, window_days, dimension='category'):
+        daily = self.daily(dimension)
+        cumulative = np.cumsum(daily.to_numpy(), axis=0)
+        windowed = cumulative.copy()
+        windowed[window_days:] -= cumulative[:-window_days]
+        return pd.DataFrame(windowed, index=daily.index, columns=daily.columns)
+
+    # Function to return the month-over-month change of monthly spend (absolute and percentage)
+    def month_over_month(self, dimension='category'):
+        monthly = self.monthly(dimension)
+        return monthly.diff(), monthly.pct_change().replace([np.inf, -np.inf], np.nan) * 100
@@ -0,0 +1,33 @@
+import os
+
+import numpy as np
+
+# Minor units per currency unit (cents per dollar)
+CENTS = 100
+
+# Monetary columns of the insurance files and the bank statements
+MONEY_COLUMNS = ['profit', 'gwp', 'total_incurred', 'Amount']
+
+# How new datasets store money unless told otherwise: 'units' (float64) or 'cents' (int64 minor units)
+MONEY_UNITS = ['units', 'cents']
+DEFAULT_MONEY = os.environ.get('MONEY_UNITS', 'units')
+if DEFAULT_MONEY not in MONEY_UNITS:
+    raise ValueError(f"MONEY_UNITS must be one of {', '.join(MONEY_UNITS)}, not {DEFAULT_MONEY!r}")
+
+
+# Function to convert amounts to int64 cents, rounded to the nearest cent.
+# Exact for amounts with at most two decimals below about 9e13 (where float64 still resolves a cent)
+def to_cents(values):
+    return np.round(np.asarray(values, dtype=float) * CENTS).astype(np.int64)
+
+
+# Function to convert cents (a number, array, Series or DataFrame) to float units, for display only
+def from_cents(cents):
+    return cents / CENTS
+
+
+# Function to sum int64 cents per group code exactly (np.bincount would sum them as float64)
+def sum_cents_by(codes, cents, num_groups):
+    totals = np.zeros(num_groups, dtype=np.int64)
+    np.add.at(totals, codes, cents)
+    return totals
@@ -0,0 +1,106 @@
+import numpy as np
+
+
+# Mergeable quantile sketch with relative-accuracy guarantees (DDSketch-style log-spaced buckets),
+# holding one row of bucket counts per key so many partitions are updated in one vectorized call
+class QuantileSketch:
+    def __init__(self, relative_accuracy=0.01, min_value=1e-2, max_value=1e12, num_keys=0):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+        self.offset = int(np.floor(np.log(min_value) / self.log_gamma))
+        self.num_buckets = int(np.ceil(np.log(max_value) / self.log_gamma)) - self.offset + 1
+
+        # Positive and negative magnitudes are counted separately; values below min_value count as zero
+        self.positive = np.zeros((num_keys, self.num_buckets), dtype=np.int64)
+        self.negative = np.zeros((num_keys, self.num_buckets), dtype=np.int64)
+        self.zero = np.zeros(num_keys, dtype=np.int64)
+
+    @property
+    def num_keys(self):
+        return self.zero.shape[0]
+
+    # Function to grow the sketch so it holds at least `num_keys` keys
+    def reserve(self, num_keys):
+        if num_keys <= self.num_keys:
+            return
+        extra = num_keys - self.num_keys
+        self.positive = np.vstack([self.positive, np.zeros((extra, self.num_buckets), dtype=np.int64)])
+        self.negative = np.vstack([self.negative, np.zeros((extra, self.num_buckets), dtype=np.int64)])
+        self.zero = np.concatenate([self.zero, np.zeros(extra, dtype=np.int64)])
+
+    # Function to map magnitudes to bucket indices (clamped to the sketch's value range)
+    def bucket_of(self, magnitudes):
+        clipped = np.clip(magnitudes, self.min_value, self.max_value)
+        return np.ceil(np.log(clipped) / self.log_gamma).astype(np.int64) - self.offset
+
+    # Function to add a batch of values, each belonging to the key with the given code
+    def add(self, key_codes, values):
+        key_codes = np.asarray(key_codes, dtype=np.int64)
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        self.reserve(int(key_codes.max()) + 1)
+
+        is_zero = np.abs(values) < self.min_value
+        np.add.at(self.zero, key_codes[is_zero], 1)
+        for counts, mask in ((self.positive, values >= self.min_value), (self.negative, values <= -self.min_value)):
+            if mask.any():
+                np.add.at(counts, (key_codes[mask], self.bucket_of(np.abs(values[mask]))), 1)
+
+    # Function to merge another sketch into this one. Its key k is this sketch's key `key_codes[k]`
+    # (the same code when None); a `sign` of -1 subtracts the other sketch's counts instead
+    def merge(self, other, key_codes=None, sign=1):
+        if key_codes is None:
+            key_codes = np.arange(other.num_keys)
+        key_codes = np.asarray(key_codes, dtype=np.int64)
+        if len(key_codes) == 0:
+            return
+        self.reserve(int(key_codes.max()) + 1)
+        np.add.at(self.positive, key_codes, sign * other.positive)
+        np.add.at(self.negative, key_codes, sign * other.negative)
+        np.add.at(self.zero, key_codes, sign * other.zero)
+
+    # Function to combine the buckets of the given keys (all keys when None) into one distribution
+    def combined(self, key_codes=None):
+        if key_codes is None:
+            key_codes = slice(None)
+        return (self.negative[key_codes].sum(axis=0), int(self.zero[key_codes].sum()),
+                self.positive[key_codes].sum(axis=0))
+
+    # Function to count the values added for the given keys
+    def count(self, key_codes=None):
+        negative, zero, positive = self.combined(key_codes)
+        return int(negative.sum()) + zero + int(positive.sum())
+
+    # Function to return the representative value of every bucket, in the same order as the combined counts
+    def bucket_values(self):
+        # The midpoint (in relative terms) of each bucket's range
+        positive = 2 * self.gamma ** (np.arange(self.num_buckets) + self.offset) / (self.gamma + 1)
+        return np.concatenate([-positive[::-1], [0.0], positive])
+
+    # Function to return the counts ordered from the most negative bucket to the largest positive bucket
+    def ordered_counts(self, key_codes=None):
+        negative, zero, positive = self.combined(key_codes)
+        return np.concatenate([negative[::-1], [zero], positive])
+
+    # Function to estimate quantiles (q between 0 and 1) over the given keys; NaN when they are empty
+    def quantiles(self, qs, key_codes=None):
+        counts = self.ordered_counts(key_codes)
+        total = counts.sum()
+        if total == 0:
+            return np.full(len(qs), np.nan)
+        ranks = np.asarray(qs, dtype=float) * (total - 1)
+        return self.bucket_values()[np.searchsorted(np.cumsum(counts), ranks, side='right')]
+
+    # Function to estimate one quantile over the given keys
+    def quantile(self, q, key_codes=None):
+        return float(self.quantiles([q], key_codes)[0])
+
+    # Function to return the non-empty buckets over the given keys as (values, counts), e.g. for histograms
+    def histogram(self, key_codes=None):
+        counts = self.ordered_counts(key_codes)
+        used = np.flatnonzero(counts)
+        return self.bucket_values()[used], counts[used]
@@ -0,0 +1,147 @@
+import argparse
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+from quantile_sketch import QuantileSketch
+from transaction_stream import generate_transactions
+
+
+# Running statistics per key (Welford mean/variance and EWMA), stored as arrays indexed by key code
+class RunningStats:
+    def __init__(self, alpha=0.05):
+        self.alpha = alpha
+        self.key_index = {}
+        self.count = np.zeros(0, dtype=np.int64)
+        self.mean = np.zeros(0)
+        self.m2 = np.zeros(0)  # Sum of squared deviations from the mean (Welford)
+        self.ewma = np.zeros(0)
+        self.ewm_var = np.zeros(0)
+
+    # Function to map a batch of keys to codes, adding slots for unseen keys
+    def codes_for(self, keys):
+        codes, uniques = pd.factorize(pd.Series(keys), use_na_sentinel=False)
+        slots = np.empty(len(uniques), dtype=np.int64)
+        for position, key in enumerate(uniques):
+            slots[position] = self.key_index.setdefault(key, len(self.key_index))
+        extra = len(self.key_index) - len(self.count)
+        if extra:
+            self.count = np.concatenate([self.count, np.zeros(extra, dtype=np.int64)])
+            for name in ('mean', 'm2', 'ewma', 'ewm_var'):
+                setattr(self, name, np.concatenate([getattr(self, name), np.zeros(extra)]))
+        return slots[codes]
+
+    # Function to compute the z-scores of values against the current statistics (NaN while warming up)
+    def z_scores(self, codes, values, min_count):
+        count = self.count[codes]
+        std = np.sqrt(self.m2[codes] / np.maximum(count - 1, 1))
+        ewm_std = np.sqrt(self.ewm_var[codes])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = np.abs(values - self.mean[codes]) / std
+            ewm_z = np.abs(values - self.ewma[codes]) / ewm_std
+        warm = count >= min_count
+        return np.where(warm, z, np.nan), np.where(warm, ewm_z, np.nan)
+
+    # Function to fold a batch of values into the statistics in one vectorized pass
+    def update(self, codes, values):
+        num_keys = len(self.count)
+        batch_count = np.bincount(codes, minlength=num_keys)
+        batch_sum = np.bincount(codes, weights=values, minlength=num_keys)
+        seen = batch_count > 0
+        batch_mean = np.divide(batch_sum, batch_count, out=np.zeros(num_keys), where=seen)
+        batch_m2 = np.bincount(codes, weights=(values - batch_mean[codes]) ** 2, minlength=num_keys)
+
+        # Chan et al. merge of the batch's (count, mean, M2) into the running Welford statistics
+        total = self.count + batch_count
+        delta = batch_mean - self.mean
+        safe_total = np.maximum(total, 1)
+        self.m2 = self.m2 + batch_m2 + delta ** 2 * self.count * batch_count / safe_total
+        self.mean = np.where(seen, self.mean + delta * batch_count / safe_total, self.mean)
+
+        # EWMA over the batch in arrival order: the i-th of m values for a key gets weight alpha*(1-alpha)**(m-i)
+        first_seen = seen & (self.count == 0)
+        self.ewma[first_seen] = batch_mean[first_seen]
+        decay = 1 - self.alpha
+        position = pd.Series(codes).groupby(codes).cumcount().to_numpy() + 1
+        weights = self.alpha * decay ** (batch_count[codes] - position)
+        retained = decay ** batch_count
+        deviation = values - self.ewma[codes]
+        self.ewm_var = retained * self.ewm_var + np.bincount(codes, weights=weights * deviation ** 2, minlength=num_keys)
+        self.ewma = retained * self.ewma + np.bincount(codes, weights=weights * values, minlength=num_keys)
+        self.count = total
+
+
+# Online anomaly detector for the transaction stream, keeping O(1) memory per CustomerId and Category
+class AnomalyDetector:
+    def __init__(self, z_threshold=4.0, quantile=0.999, min_count=30, alpha=0.05):
+        self.z_threshold = z_threshold
+        self.quantile = quantile
+        self.min_count = min_count
+        # Samples a category needs before its quantile means anything: below 1 / (1 - quantile) samples
+        # the quantile is just the category's largest amount so far (1000 samples for p99.9)
+        self.min_quantile_count = max(min_count, math.ceil(1 / (1 - quantile)))
+        self.by_customer = RunningStats(alpha)
+        self.by_category = RunningStats(alpha)
+        self.category_sketch = QuantileSketch()
+
+    # Function to score a batch against the statistics seen so far, then fold it in; returns the flagged rows
+    def process(self, transactions):
+        if transactions.empty:
+            return transactions.assign(reason=pd.Series(dtype=str))
+        amounts = pd.to_numeric(transactions['Amount'], errors='coerce').fillna(0).to_numpy(dtype=float)
+        customer_codes = self.by_customer.codes_for(transactions['CustomerId'].to_numpy())
+        category_codes = self.by_category.codes_for(transactions['Category'].to_numpy())
+
+        customer_z, customer_ewm_z = self.by_customer.z_scores(customer_codes, amounts, self.min_count)
+        category_z, category_ewm_z = self.by_category.z_scores(category_codes, amounts, self.min_count)
+
+        # Per-category high quantile from the sketch (only for categories with enough samples for it)
+        thresholds = np.full(len(self.by_category.count), np.inf)
+        warm = np.flatnonzero(self.by_category.count >= self.min_quantile_count)
+        for code in warm:
+            thresholds[code] = self.category_sketch.quantile(self.quantile, [code])
+
+        reasons = np.full(len(amounts), '', dtype=object)
+        checks = [
+            (customer_z, 'customer z-score'),
+            (customer_ewm_z, 'customer EWMA'),
+            (category_z, 'category z-score'),
+            (category_ewm_z, 'category EWMA'),
+        ]
+        for scores, reason in checks:
+            hit = np.nan_to_num(scores) > self.z_threshold
+            reasons[hit] = np.where(reasons[hit] == '', reason, reasons[hit] + ', ' + reason)
+        above = amounts > thresholds[category_codes]
+        label = f'above category p{self.quantile * 100:g}'
+        reasons[above] = np.where(reasons[above] == '', label, reasons[above] + ', ' + label)
+
+        self.by_customer.update(customer_codes, amounts)
+        self.by_category.update(category_codes, amounts)
+        self.category_sketch.add(category_codes, amounts)
+
+        flagged = reasons != ''
+        return transactions[flagged].assign(reason=reasons[flagged])
+
+
+# Function to measure detector throughput on batches from the random transaction generator
+def benchmark(num_events=1000000, batch_size=10000, seed=0):
+    rng = np.random.default_rng(seed)
+    detector = AnomalyDetector()
+    batches = [generate_transactions(batch_size, rng) for _ in range(num_events // batch_size)]
+
+    start = time.perf_counter()
+    flagged = sum(len(detector.process(batch)) for batch in batches)
+    seconds = time.perf_counter() - start
+    return num_events / seconds, flagged
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure anomaly detector throughput.")
+    parser.add_argument('--events', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    events_per_second, flagged = benchmark(args.events, args.batch_size)
+    print(f"{events_per_second:,.0f} events/s ({flagged} flagged)")
@@ -0,0 +1,19 @@
+import numpy as np
+import pandas as pd
+
+# Categories of the randomly generated (live) transactions
+CATEGORIES = ['Rent', 'Groceries', 'Restaurant', 'Bills', 'Health', 'Salary']
+
+
+# Function to generate a batch of random transactions in one vectorized call
+def generate_transactions(num_rows, rng=None, timestamp=None):
+    rng = np.random.default_rng() if rng is None else rng
+    timestamp = pd.Timestamp.now() if timestamp is None else timestamp
+    return pd.DataFrame({
+        'Date': np.full(num_rows, timestamp.strftime('%Y-%m-%d %H:%M:%S')),
+        'Description': np.full(num_rows, 'Random Transaction'),
+        'Amount': rng.integers(1, 1000, num_rows),
+        'Category': np.asarray(CATEGORIES)[rng.integers(0, len(CATEGORIES), num_rows)],
+        'Dr/Cr': np.asarray(['Dr', 'Cr'])[rng.integers(0, 2, num_rows)],
+        'CustomerId': rng.integers(1, 100, num_rows)  # Simulating customer IDs
+    })
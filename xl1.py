@@ -1,33 +1,48 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
-import plotly.express as px
-import plotly.figure_factory as ff
 import base64
 import time
 
-# Function to load data from CSV (for initial load only)
+from dashboard_timing import finish_rerun, render_timing_panel, span, start_rerun
+from data_validation import SCHEMAS, ValidationReport
+from expense_store import ExpenseStore
+from insurance_loader import read_validated_file
+from lazy_modules import lazy_import
+from ledger_timeseries import SpendStore
+from transaction_anomalies import AnomalyDetector
+from transaction_stream import generate_transactions
+
+# Chart backends are imported on first use, so they do not slow down process start
+px = lazy_import('plotly.express')
+ff = lazy_import('plotly.figure_factory')
+
+# The heatmap shows the descriptions with the largest amounts; the rest are summed into one column
+HEATMAP_TOP_DESCRIPTIONS = 15
+
+# Function to load data from CSV (for initial load only), validated in the same pass;
+# returns the valid rows, the quarantined rows and the validation report
 def load_data():
     try:
-        df = pd.read_csv("insurance_data.csv")
-        return df
+        df, quarantined, report = read_validated_file("insurance_data.csv", SCHEMAS['bank_statement'])
+        return df, quarantined, report
     except FileNotFoundError:
-        return pd.DataFrame(columns=['Date', 'Description', 'Amount', 'Category', 'Dr/Cr', 'CustomerId'])
+        columns = ['Date', 'Description', 'Amount', 'Category', 'Dr/Cr', 'CustomerId']
+        return pd.DataFrame(columns=columns), pd.DataFrame(columns=columns + ['violation']), ValidationReport()
 
 # Function to generate random data
 def generate_random_data():
-    categories = ['Rent', 'Groceries', 'Restaurant', 'Bills', 'Health', 'Salary']
-    category = np.random.choice(categories)
-    amount = np.random.randint(1, 1000)
-    dr_cr = np.random.choice(['Dr', 'Cr'])
-    return {
-        'Date': pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'Description': 'Random Transaction',
-        'Amount': amount,
-        'Category': category,
-        'Dr/Cr': dr_cr,
-        'CustomerId': np.random.randint(1, 100)  # Simulating customer IDs
-    }
+    # One row from the batched generator (see transaction_stream.py)
+    return generate_transactions(1).to_dict('records')[0]
+
+# Function to add expense rows to the expense store, the time-bucketed spend store and the anomaly detector
+def add_expenses(new_rows):
+    st.session_state.expense_store.append(new_rows)
+    st.session_state.spend_store.add_transactions(new_rows)
+
+    # Keep the flagged transactions (newest last) for the anomalies panel
+    flagged = st.session_state.anomaly_detector.process(new_rows)
+    if not flagged.empty:
+        st.session_state.anomalies = pd.concat([st.session_state.anomalies, flagged], ignore_index=True)
 
 # Function to encode a name in Base64
 def encode_name(name):
@@ -78,22 +93,46 @@ st.markdown(
 
 # Main app
 def main():
+    # Time each stage of this rerun
+    start_rerun('xl1')
+
     st.title("Family Expenses Tracker")
 
-    # Load initial data from CSV to display
-    if 'df' not in st.session_state:
-        st.session_state.df = load_data()
+    # Load initial data from CSV into the expense store: the only copy of the ledger, with Date, Description,
+    # Category and Dr/Cr as dictionary codes, so groupings and the heatmap run on integers
+    if 'expense_store' not in st.session_state:
+        with span('load'):
+            df, st.session_state.quarantined, st.session_state.validation_report = load_data()
+            st.session_state.expense_store = ExpenseStore()
+            st.session_state.expense_store.append(df)
+            st.session_state.loaded_rows = len(df)  # Only the rows added after these can be deleted
+    expense_store = st.session_state.expense_store
+
+    # Rows of the CSV that failed validation are kept out of the charts and listed here
+    report = st.session_state.validation_report
+    if report.rows_quarantined:
+        with st.expander(f"Data Validation ({report.rows_quarantined} of {report.rows_checked} rows quarantined)"):
+            st.dataframe(report.summary())
+            st.dataframe(st.session_state.quarantined)
+
+    # Daily spend per category and customer, updated as rows are added so trends never rescan the ledger
+    if 'spend_store' not in st.session_state:
+        st.session_state.spend_store = SpendStore()
+        st.session_state.spend_store.add_transactions(expense_store.frame())
 
-    # DataFrame to hold added expenses during the session
-    if 'added_expenses' not in st.session_state:
-        st.session_state.added_expenses = pd.DataFrame(columns=['Date', 'Description', 'Amount', 'Category', 'Dr/Cr', 'CustomerId'])
+    # Running statistics per customer and category; the loaded data only warms them up
+    if 'anomaly_detector' not in st.session_state:
+        st.session_state.anomaly_detector = AnomalyDetector()
+        st.session_state.anomaly_detector.process(expense_store.frame(0, st.session_state.loaded_rows))
+        st.session_state.anomalies = pd.DataFrame(columns=['Date', 'Description', 'Amount', 'Category', 'Dr/Cr', 'CustomerId', 'reason'])
 
     # Live data state
     if 'live_data_running' not in st.session_state:
         st.session_state.live_data_running = False
 
-    # Combine loaded data and manually added data for display
-    combined_data = pd.concat([st.session_state.df, st.session_state.added_expenses], ignore_index=True)
+    # Loaded and added rows for display, as categoricals over the store's dictionaries
+    with span('combine'):
+        combined_data = expense_store.frame()
 
     # First Row: Display Pie Chart, Bar Graph, Heatmap
     col4, col5, col6 = st.columns(3)
@@ -101,37 +140,45 @@ def main():
     with col4:
         st.markdown('<div class="panel">Expenses Pie Chart</div>', unsafe_allow_html=True)
         if not combined_data.empty:
-            fig = px.pie(combined_data, names='Category', values='Amount', title='Expenses Distribution')
-            st.plotly_chart(fig)
+            with span('figure'):
+                fig = px.pie(combined_data, names='Category', values='Amount', title='Expenses Distribution')
+            with span('serialize'):
+                st.plotly_chart(fig)
         else:
             st.markdown('<div class="panel">Load expenses to see the pie chart.</div>', unsafe_allow_html=True)
 
     with col5:
         st.markdown('<div class="panel">Expenses Bar Graph</div>', unsafe_allow_html=True)
         if not combined_data.empty:
-            bar_fig = px.bar(
-                combined_data,
-                x='Category',
-                y='Amount',
-                title='Expenses by Category',
-                color='Category',
-                color_discrete_sequence=px.colors.qualitative.Set2
-            )
-            st.plotly_chart(bar_fig)
+            with span('figure'):
+                bar_fig = px.bar(
+                    combined_data,
+                    x='Category',
+                    y='Amount',
+                    title='Expenses by Category',
+                    color='Category',
+                    color_discrete_sequence=px.colors.qualitative.Set2
+                )
+            with span('serialize'):
+                st.plotly_chart(bar_fig)
         else:
             st.markdown('<div class="panel">Load expenses to see the bar graph.</div>', unsafe_allow_html=True)
 
     with col6:
         st.markdown('<div class="panel">Expenses Heatmap</div>', unsafe_allow_html=True)
         if not combined_data.empty:
-            heatmap_data = combined_data.groupby(['Category', 'Description'])['Amount'].sum().unstack(fill_value=0)
-            heatmap_fig = ff.create_annotated_heatmap(
-                z=heatmap_data.values,
-                x=heatmap_data.columns.tolist(),
-                y=heatmap_data.index.tolist(),
-                colorscale='Viridis'
-            )
-            st.plotly_chart(heatmap_fig)
+            with span('groupby'):
+                # Category x top descriptions, summed on the dictionary codes
+                heatmap_data = expense_store.heatmap(HEATMAP_TOP_DESCRIPTIONS)
+            with span('figure'):
+                heatmap_fig = ff.create_annotated_heatmap(
+                    z=heatmap_data.values,
+                    x=heatmap_data.columns.tolist(),
+                    y=heatmap_data.index.tolist(),
+                    colorscale='Viridis'
+                )
+            with span('serialize'):
+                st.plotly_chart(heatmap_fig)
         else:
             st.markdown('<div class="panel">Load expenses to see the heatmap.</div>', unsafe_allow_html=True)
 
@@ -141,35 +188,79 @@ def main():
     with col7:
         st.markdown('<div class="panel">Income vs Expenses</div>', unsafe_allow_html=True)
         if not combined_data.empty:
-            income_expense_data = combined_data.groupby('Dr/Cr')['Amount'].sum().reset_index()
-            fig_income_expense = px.pie(income_expense_data, names='Dr/Cr', values='Amount', title='Income vs Expenses', color_discrete_sequence=['#1f77b4', '#ff7f0e'])
-            st.plotly_chart(fig_income_expense)
+            with span('groupby'):
+                income_expense_data = combined_data.groupby('Dr/Cr', observed=True)['Amount'].sum().reset_index()
+            with span('figure'):
+                fig_income_expense = px.pie(income_expense_data, names='Dr/Cr', values='Amount', title='Income vs Expenses', color_discrete_sequence=['#1f77b4', '#ff7f0e'])
+            with span('serialize'):
+                st.plotly_chart(fig_income_expense)
         else:
             st.markdown('<div class="panel">Load data to see the income vs expenses.</div>', unsafe_allow_html=True)
 
     with col8:
         st.markdown('<div class="panel">Mostly Expensed Category</div>', unsafe_allow_html=True)
         if not combined_data.empty:
-            most_expensed = combined_data.groupby('Category')['Amount'].sum().reset_index()
-            fig_most_expensed_bar = px.bar(
-                most_expensed,
-                x='Category',
-                y='Amount',
-                title='Mostly Expensed Category',
-                color='Category',
-                color_discrete_sequence=px.colors.qualitative.Set2
-            )
-            st.plotly_chart(fig_most_expensed_bar)
+            with span('groupby'):
+                most_expensed = expense_store.totals_by_category().reset_index()
+            with span('figure'):
+                fig_most_expensed_bar = px.bar(
+                    most_expensed,
+                    x='Category',
+                    y='Amount',
+                    title='Mostly Expensed Category',
+                    color='Category',
+                    color_discrete_sequence=px.colors.qualitative.Set2
+                )
+            with span('serialize'):
+                st.plotly_chart(fig_most_expensed_bar)
         else:
             st.markdown('<div class="panel">Load expenses to see the mostly expensed categories.</div>', unsafe_allow_html=True)
 
+    # Third Row: Spending trends from the time-bucketed store
+    col9, col10 = st.columns(2)
+    spend_store = st.session_state.spend_store
+
+    with col9:
+        st.markdown('<div class="panel">Rolling Spend by Category</div>', unsafe_allow_html=True)
+        if spend_store.num_days:
+            window_days = st.radio("Window", options=[7, 30], format_func=lambda days: f"{days} days", horizontal=True)
+            with span('groupby'):
+                # Only the last 90 days are plotted
+                rolling_spend = spend_store.rolling(window_days).tail(90)
+            with span('figure'):
+                fig_rolling = px.line(rolling_spend, title=f'{window_days}-Day Rolling Spend', labels={'value': 'Amount', 'variable': 'Category'})
+            with span('serialize'):
+                st.plotly_chart(fig_rolling)
+        else:
+            st.markdown('<div class="panel">Load expenses to see the spending trend.</div>', unsafe_allow_html=True)
+
+    with col10:
+        st.markdown('<div class="panel">Month over Month</div>', unsafe_allow_html=True)
+        if spend_store.num_days:
+            with span('groupby'):
+                monthly_spend = spend_store.monthly()
+                monthly_change, monthly_change_percent = spend_store.month_over_month()
+            # Show the last 6 months of spend, and the change from the previous month in percent
+            st.dataframe(monthly_spend.tail(6).rename(index=str).round(2))
+            st.dataframe(monthly_change_percent.tail(6).rename(index=str).round(1).astype(str).replace('nan', '-') + ' %')
+        else:
+            st.markdown('<div class="panel">Load expenses to see the monthly changes.</div>', unsafe_allow_html=True)
+
     # Display DataFrame
     st.markdown('<div class="panel">Expenses Data</div>', unsafe_allow_html=True)
     if not combined_data.empty:
-        st.dataframe(combined_data)
+        with span('serialize'):
+            st.dataframe(combined_data)
     else:
         st.markdown('<div class="panel">No data available.</div>', unsafe_allow_html=True)
 
+    # Display transactions flagged by the anomaly detector
+    st.markdown('<div class="panel">Flagged Transactions</div>', unsafe_allow_html=True)
+    if not st.session_state.anomalies.empty:
+        st.dataframe(st.session_state.anomalies.iloc[::-1])
+    else:
+        st.markdown('<div class="panel">No unusual transactions so far.</div>', unsafe_allow_html=True)
+
     # Manual Entry
     col1, col2 = st.columns(2)
 
@@ -191,8 +282,7 @@ def main():
                     'Dr/Cr': dr_cr,
                     'CustomerId': customer_id
                 }
-                st.session_state.added_expenses = pd.concat([st.session_state.added_expenses, pd.DataFrame([new_row])],
-                                                            ignore_index=True)
+                add_expenses(pd.DataFrame([new_row]))
                 st.success("Expense added!")
 
                 st.markdown("""<script>
@@ -204,16 +294,16 @@ def main():
             elif submitted:
                 st.error("Please provide a valid description and amount.")
 
-        if st.button("Delete Last Expense") and not st.session_state.added_expenses.empty:
-            st.session_state.added_expenses = st.session_state.added_expenses[:-1]
+        if st.button("Delete Last Expense") and len(expense_store) > st.session_state.loaded_rows:
+            st.session_state.spend_store.add_transactions(expense_store.frame(len(expense_store) - 1), sign=-1)
+            expense_store.remove_last(1)
             st.success("Last expense deleted!")
 
     with col2:
         st.markdown('<div class="panel">Add Random Expense</div>', unsafe_allow_html=True)
         if st.button("Add Live Data Expense"):
             new_row = generate_random_data()
-            st.session_state.added_expenses = pd.concat([st.session_state.added_expenses, pd.DataFrame([new_row])],
-                                                        ignore_index=True)
+            add_expenses(pd.DataFrame([new_row]))
             st.success("Random expense added!")
 
             st.markdown("""<script>
@@ -229,11 +319,16 @@ def main():
             else:
                 st.success("Live data collection stopped!")
 
+    # Show where this rerun spent its time (the timings are also appended to $DASHBOARD_TIMING_LOG when set)
+    if st.sidebar.checkbox('Show timing panel', value=False):
+        render_timing_panel(st.sidebar)
+    else:
+        finish_rerun()
+
     # Live data adding logic
     if st.session_state.live_data_running:
         new_row = generate_random_data()
-        st.session_state.added_expenses = pd.concat([st.session_state.added_expenses, pd.DataFrame([new_row])],
-                                                    ignore_index=True)
+        add_expenses(pd.DataFrame([new_row]))
         time.sleep(1)  # Add a delay to control the speed of live data generation
         st.rerun()  # Rerun the app to show the new data
 